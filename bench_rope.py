@@ -0,0 +1,141 @@
+import os
+import random
+import sys
+import time
+
+from rope_editor import TextEditor, Rope, LEAF_SIZE
+
+# Benchmark for the rope editor, run with: python bench_rope.py
+# Prints the average cost of a single edit for growing document sizes,
+# with balanced split/concat the per edit cost should stay roughly flat.
+# Then compares memory and edit latency across leaf sizes, and times search,
+# replace-all, parallel search and building ropes. Pass --large to also
+# build a 1 GB rope
+
+SIZES = [10_000, 100_000, 1_000_000]
+EDITS = 2_000
+LEAF_SIZES = [5, 64, 512, 1024, 4096]
+BUILD_SIZES = [1 << 20, 10 << 20, 100 << 20]
+PARALLEL_SIZE = 100 << 20
+
+def bench_edits(size, edits=EDITS, seed=0, maxlen=LEAF_SIZE):
+    # Average microseconds per insert and per delete on a document of size chars
+    rnd = random.Random(seed)
+    te = TextEditor(Rope.from_string("x" * size, maxlen=maxlen))
+    start = time.perf_counter()
+    for _ in range(edits):
+        te.insert_string(rnd.randint(0, te.length()), "abc")
+    insert_us = (time.perf_counter() - start) / edits * 1e6
+    start = time.perf_counter()
+    for _ in range(edits):
+        te.delete_chars(rnd.randint(0, te.length() - 3), 3)
+    delete_us = (time.perf_counter() - start) / edits * 1e6
+    return insert_us, delete_us
+
+def bench_memory(size, maxlen):
+    # Bytes per char stored for a rope of size chars, from memory_report
+    te = TextEditor(Rope.from_string("x" * size, maxlen=maxlen))
+    return te.memory_report()['bytes_per_char']
+
+def bench_search(size, maxlen=LEAF_SIZE):
+    # Milliseconds for the first match and for all matches of a pattern
+    # that occurs every 1000 chars
+    block = "x" * 995 + "match"
+    te = TextEditor(Rope.from_string(block * (size // len(block)), maxlen=maxlen))
+    start = time.perf_counter()
+    next(te.iter_search("match"))
+    first_ms = (time.perf_counter() - start) * 1e3
+    start = time.perf_counter()
+    te.search_string("match")
+    all_ms = (time.perf_counter() - start) * 1e3
+    return first_ms, all_ms
+
+def bench_replace_all(size, maxlen=LEAF_SIZE):
+    # Milliseconds to replace a pattern that occurs every 1000 chars, with
+    # one delete_chars and insert_string per match and with one batch
+    block = "x" * 995 + "match"
+    text = block * (size // len(block))
+    te = TextEditor(Rope.from_string(text, maxlen=maxlen))
+    start = time.perf_counter()
+    for idx in reversed(te.search_string("match")):
+        te.delete_chars(idx, 5)
+        te.insert_string(idx, "found")
+    single_ms = (time.perf_counter() - start) * 1e3
+    te = TextEditor(Rope.from_string(text, maxlen=maxlen))
+    start = time.perf_counter()
+    te.replace_all("match", "found")
+    batch_ms = (time.perf_counter() - start) * 1e3
+    return single_ms, batch_ms
+
+def bench_parallel_search(size, workers, maxlen=LEAF_SIZE):
+    # Milliseconds for the first parallel search on a pool of workers
+    # processes, which includes starting them and copying the text to shared
+    # memory, and for a repeated search
+    block = "x" * 995 + "match"
+    te = TextEditor(Rope.from_string(block * (size // len(block)), maxlen=maxlen))
+    te.enable_parallel_search(workers, min_length=0)
+    try:
+        start = time.perf_counter()
+        te.search_string("match")
+        first_ms = (time.perf_counter() - start) * 1e3
+        start = time.perf_counter()
+        te.search_string("match")
+        repeat_ms = (time.perf_counter() - start) * 1e3
+    finally:
+        te.disable_parallel_search()
+    return first_ms, repeat_ms
+
+def bench_build(size, maxlen=LEAF_SIZE):
+    # Milliseconds to build a rope of size chars with from_string, and with
+    # from_chunks from 1 MB chunks
+    text = "x" * size
+    start = time.perf_counter()
+    Rope.from_string(text, maxlen=maxlen)
+    string_ms = (time.perf_counter() - start) * 1e3
+    chunk = 1 << 20
+    start = time.perf_counter()
+    Rope.from_chunks((text[i:i+chunk] for i in range(0, size, chunk)), maxlen=maxlen)
+    chunks_ms = (time.perf_counter() - start) * 1e3
+    return string_ms, chunks_ms
+
+if __name__ == '__main__':
+    print(f"{'size':>10} {'insert us':>10} {'delete us':>10}")
+    for size in SIZES:
+        insert_us, delete_us = bench_edits(size)
+        print(f"{size:>10} {insert_us:>10.1f} {delete_us:>10.1f}")
+
+    print()
+    size = SIZES[-1]
+    print(f"leaf sizes on a document of {size} chars")
+    print(f"{'maxlen':>10} {'bytes/char':>10} {'insert us':>10} {'delete us':>10}")
+    for maxlen in LEAF_SIZES:
+        per_char = bench_memory(size, maxlen)
+        insert_us, delete_us = bench_edits(size, maxlen=maxlen)
+        print(f"{maxlen:>10} {per_char:>10.2f} {insert_us:>10.1f} {delete_us:>10.1f}")
+
+    print()
+    print(f"{'size':>10} {'first ms':>10} {'all ms':>10}")
+    for size in SIZES:
+        first_ms, all_ms = bench_search(size)
+        print(f"{size:>10} {first_ms:>10.3f} {all_ms:>10.1f}")
+
+    print()
+    print(f"{'size':>10} {'edits ms':>10} {'batch ms':>10}")
+    for size in SIZES:
+        single_ms, batch_ms = bench_replace_all(size)
+        print(f"{size:>10} {single_ms:>10.1f} {batch_ms:>10.1f}")
+
+    print()
+    size = PARALLEL_SIZE
+    _, serial_ms = bench_search(size)
+    print(f"parallel search on a document of {size} chars, single-threaded: {serial_ms:.1f} ms")
+    print(f"{'workers':>10} {'first ms':>10} {'repeat ms':>10} {'speedup':>10}")
+    for workers in sorted({1, 2, 4, os.cpu_count() or 1}):
+        first_ms, repeat_ms = bench_parallel_search(size, workers)
+        print(f"{workers:>10} {first_ms:>10.1f} {repeat_ms:>10.1f} {serial_ms / repeat_ms:>10.2f}")
+
+    print()
+    print(f"{'size':>10} {'string ms':>10} {'chunks ms':>10} {'ns/char':>10}")
+    for size in BUILD_SIZES + ([1 << 30] if '--large' in sys.argv else []):
+        string_ms, chunks_ms = bench_build(size)
+        print(f"{size:>10} {string_ms:>10.1f} {chunks_ms:>10.1f} {string_ms * 1e6 / size:>10.2f}")
@@ -0,0 +1,107 @@
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+
+# Load generator for rope_server.py, run with: python bench_server.py
+# Starts a server on a free port (or uses --connect host:port), fills the
+# document, then runs --clients connections that each keep --depth
+# requests in flight. Each client types at its own position, with some
+# deletes, reads and searches mixed in. Reports requests per second and
+# the p50 and p99 latency, from sending a request to reading its response
+
+# Longest response line the clients accept
+LINE_LIMIT = 1 << 26
+
+WORDS = ["rope", "editor", "text", "node", "leaf", "split", "concat", "the", "a", "of"]
+
+def make_request(rid, rnd, state, size):
+    # Return the next request of a client, state is [position]
+    r = rnd.random()
+    if r < 0.01:
+        state[0] = rnd.randint(0, size // 2)
+    if r < 0.70:
+        state[0] += 1
+        return {'id': rid, 'op': 'insert', 'index': state[0] - 1, 'text': "x"}
+    if r < 0.80 and state[0] > 0:
+        state[0] -= 1
+        return {'id': rid, 'op': 'delete', 'index': state[0], 'count': 1}
+    if r < 0.99:
+        return {'id': rid, 'op': 'get', 'index': state[0], 'count': 100}
+    return {'id': rid, 'op': 'search', 'pattern': rnd.choice(WORDS)}
+
+async def client(host, port, ops, depth, size, seed, latencies):
+    # Send ops requests keeping depth of them in flight, appends the latency
+    # of each to latencies, returns the number of error responses
+    # Search results may be long lines
+    reader, writer = await asyncio.open_connection(host, port, limit=LINE_LIMIT)
+    rnd = random.Random(seed)
+    state = [rnd.randint(0, size // 2)]
+    sent = {}
+    errors = 0
+    for rid in range(min(depth, ops)):
+        sent[rid] = time.perf_counter()
+        writer.write((json.dumps(make_request(rid, rnd, state, size)) + "\n").encode())
+    nxt = len(sent)
+    while sent:
+        resp = json.loads(await reader.readline())
+        latencies.append(time.perf_counter() - sent.pop(resp['id']))
+        if 'error' in resp:
+            errors += 1
+        if nxt < ops:
+            sent[nxt] = time.perf_counter()
+            writer.write((json.dumps(make_request(nxt, rnd, state, size)) + "\n").encode())
+            nxt += 1
+    writer.close()
+    await writer.wait_closed()
+    return errors
+
+async def run(host, port, clients, ops, depth, size):
+    # Fill the document, then run the clients. Returns (seconds, latencies,
+    # errors)
+    reader, writer = await asyncio.open_connection(host, port)
+    words = random.Random(0)
+    text = " ".join(words.choice(WORDS) for _ in range(size // 4))[:size]
+    writer.write((json.dumps({'id': 0, 'op': 'insert', 'index': 0, 'text': text}) + "\n").encode())
+    await reader.readline()
+    writer.close()
+    latencies = []
+    start = time.perf_counter()
+    errors = await asyncio.gather(*(client(host, port, ops, depth, size, seed, latencies) for seed in range(clients)))
+    return time.perf_counter() - start, latencies, sum(errors)
+
+def percentile(values, p):
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load generator for rope_server.py")
+    parser.add_argument('--connect', help="host:port of a running server, one is started otherwise")
+    parser.add_argument('--clients', type=int, default=8, help="number of connections")
+    parser.add_argument('--depth', type=int, default=16, help="requests in flight per connection")
+    parser.add_argument('--ops', type=int, default=5000, help="requests per connection")
+    parser.add_argument('--size', type=int, default=1_000_000, help="initial document size in chars")
+    args = parser.parse_args()
+
+    proc = None
+    if args.connect:
+        host, port = args.connect.rsplit(':', 1)
+    else:
+        proc = subprocess.Popen([sys.executable, 'rope_server.py', '--port', '0'],
+                                stdout=subprocess.PIPE, text=True)
+        # "Serving on host:port"
+        host, port = proc.stdout.readline().split()[-1].rsplit(':', 1)
+    try:
+        elapsed, latencies, errors = asyncio.run(run(host, int(port), args.clients, args.ops, args.depth, args.size))
+    finally:
+        if proc != None:
+            proc.terminate()
+            proc.wait()
+    latencies.sort()
+    print(f"{len(latencies)} requests from {args.clients} clients, depth {args.depth}, in {elapsed:.2f} s")
+    print(f"{len(latencies) / elapsed:.0f} requests/s")
+    print(f"p50 {percentile(latencies, 0.50) * 1e3:.2f} ms, p99 {percentile(latencies, 0.99) * 1e3:.2f} ms")
+    if errors:
+        print(f"{errors} error responses")
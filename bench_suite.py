@@ -0,0 +1,216 @@
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import time
+
+from rope_editor import TextEditor, Rope
+
+# Reproducible benchmark suite for TextEditor workloads.
+# Every workload runs on the same seeded document for each document size and
+# leaf size (maxlen), and reports microseconds per operation. Results are
+# written as JSON and compared against a stored baseline:
+#   python bench_suite.py --save-baseline       # record bench_baseline.json
+#   python bench_suite.py                       # compare, exit 1 on regression
+#                                               # or when there is no baseline
+#   python bench_suite.py --output results.json # also keep the results
+# Timings are the best of --repeat runs, a result is a regression when it is
+# more than --tolerance slower than the baseline. Both runs also time a fixed
+# pure Python loop, and timings are scaled by its ratio so that a machine
+# that is busier than when the baseline was recorded does not show up as a
+# regression. Baselines are still only meaningful on the machine that
+# recorded them
+
+SIZES = [10_000, 100_000, 1_000_000]
+MAXLENS = [64, 1024, 4096]
+QUICK_SIZES = [10_000, 100_000]
+QUICK_MAXLENS = [1024]
+BASELINE = 'bench_baseline.json'
+WORDS = ["rope", "editor", "text", "node", "leaf", "split", "concat", "the", "a", "of"]
+
+def make_text(size, seed=0):
+    # Deterministic text of size chars made of words and lines
+    rnd = random.Random(seed)
+    parts = []
+    length = 0
+    while length < size:
+        line = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(3, 12))) + "\n"
+        parts.append(line)
+        length += len(line)
+    return "".join(parts)[:size]
+
+# Each workload takes a TextEditor and a seeded Random, runs its operations
+# and returns how many it ran
+
+def typing(te, rnd):
+    # Type 2000 chars one at a time from a random position
+    idx = rnd.randint(0, te.length())
+    for i in range(2000):
+        te.insert_string(idx + i, "x")
+    return 2000
+
+def random_edits(te, rnd):
+    # 1000 inserts and 1000 deletes at random positions
+    for _ in range(1000):
+        te.insert_string(rnd.randint(0, te.length()), "edit")
+        te.delete_chars(rnd.randint(0, te.length() - 4), 4)
+    return 2000
+
+def paste(te, rnd):
+    # Paste a block of a tenth of the document 5 times
+    block = make_text(te.length() // 10, seed=1)
+    for _ in range(5):
+        te.insert_string(rnd.randint(0, te.length()), block)
+    return 5
+
+def undo_redo(te, rnd):
+    # 200 separate edits, then undo all of them and redo all of them, twice
+    for _ in range(200):
+        te.insert_string(rnd.randint(0, te.length()), "undo")
+        te.delete_chars(rnd.randint(0, te.length() - 2), 2)
+    ops = 0
+    for _ in range(2):
+        while te.undo():
+            ops += 1
+        while te.redo():
+            ops += 1
+    return ops
+
+def substring(te, rnd):
+    # 2000 reads of 100 chars at random positions
+    for _ in range(2000):
+        te.get_substring(rnd.randint(0, te.length() - 100), 100)
+    return 2000
+
+def search(te, rnd):
+    # Search the whole document for a word 5 times
+    for _ in range(5):
+        te.search_string("concat")
+    return 5
+
+WORKLOADS = {
+    'typing': typing,
+    'random_edits': random_edits,
+    'paste': paste,
+    'undo_redo': undo_redo,
+    'substring': substring,
+    'search': search,
+}
+
+def calibrate(repeat):
+    # Return the best time in microseconds of a fixed pure Python loop
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        d = {}
+        for i in range(200_000):
+            d[i % 1000] = str(i)
+        elapsed = (time.perf_counter() - start) * 1e6
+        if best == None or elapsed < best:
+            best = elapsed
+    return best
+
+def run_workload(name, size, maxlen, repeat):
+    # Return the result dict for one workload, the time is the best of
+    # repeat runs, each on a fresh editor
+    text = make_text(size)
+    best = None
+    for _ in range(repeat):
+        # Coalescing would merge the undo_redo edits into few operations
+        te = TextEditor(Rope.from_string(text, maxlen=maxlen), coalesce=False)
+        rnd = random.Random(size + maxlen)
+        # Collections of the earlier runs' garbage would add noise, as
+        # timeit does the collector is off while timing
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            ops = WORKLOADS[name](te, rnd)
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        if best == None or elapsed < best:
+            best = elapsed
+    return {
+        'workload': name,
+        'size': size,
+        'maxlen': maxlen,
+        'ops': ops,
+        'us_per_op': best / ops * 1e6,
+        'bytes_per_char': te.memory_report()['bytes_per_char'],
+    }
+
+def run_suite(sizes, maxlens, workloads, repeat):
+    results = []
+    calibration = calibrate(repeat)
+    for name in workloads:
+        for size in sizes:
+            for maxlen in maxlens:
+                result = run_workload(name, size, maxlen, repeat)
+                print(f"{name:>12} {size:>9} {maxlen:>6} {result['us_per_op']:>12.2f} us/op", file=sys.stderr)
+                results.append(result)
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'calibration_us': (calibration + calibrate(repeat)) / 2,
+        'results': results,
+    }
+
+def compare(report, baseline, tolerance):
+    # Return a list of messages for results slower than the baseline by more
+    # than tolerance, or using more memory
+    key = lambda r: (r['workload'], r['size'], r['maxlen'])
+    old = {key(r): r for r in baseline['results']}
+    speed = report['calibration_us'] / baseline['calibration_us']
+    regressions = []
+    for r in report['results']:
+        base = old.get(key(r))
+        if base == None:
+            continue
+        ratio = r['us_per_op'] / base['us_per_op'] / speed
+        if ratio > 1 + tolerance:
+            regressions.append(f"{r['workload']} size={r['size']} maxlen={r['maxlen']}: "
+                               f"{base['us_per_op']:.2f} -> {r['us_per_op']:.2f} us/op ({ratio:.2f}x)")
+        if r['bytes_per_char'] > base['bytes_per_char'] * (1 + tolerance):
+            regressions.append(f"{r['workload']} size={r['size']} maxlen={r['maxlen']}: "
+                               f"{base['bytes_per_char']:.2f} -> {r['bytes_per_char']:.2f} bytes/char")
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark suite for the rope text editor")
+    parser.add_argument('--quick', action='store_true', help="fewer sizes and leaf sizes")
+    parser.add_argument('--workload', action='append', choices=sorted(WORKLOADS), help="run only this workload, may be repeated")
+    parser.add_argument('--repeat', type=int, default=5, help="runs per result, the best one is kept")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--baseline', default=BASELINE, help="baseline JSON file to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="store the results as the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown, 0.25 means 25%%")
+    args = parser.parse_args()
+
+    report = run_suite(QUICK_SIZES if args.quick else SIZES,
+                       QUICK_MAXLENS if args.quick else MAXLENS,
+                       args.workload or list(WORKLOADS), args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        sys.exit(0)
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        # A check that compares against nothing must not pass
+        print(f"No baseline at {args.baseline}, run with --save-baseline to record one")
+        sys.exit(1)
+    regressions = compare(report, baseline, args.tolerance)
+    if regressions:
+        print(f"PERFORMANCE REGRESSION against {args.baseline}:")
+        for msg in regressions:
+            print(f"  {msg}")
+        sys.exit(1)
+    print(f"No regressions against {args.baseline}")
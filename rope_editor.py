@@ -1,29 +1,90 @@
+import codecs
+import concurrent.futures
+import functools
+import mmap
+import os
+import re
+import sys
+import tempfile
+import time
+from multiprocessing import shared_memory
+
 class Operation:
     INSERT=1
     DELETE=2
+    BATCH=3
+    __slots__ = ('tp', 'params', 'next', 'prev', 'before', 'after')
     def __init__(self, tp, params):
         #tp: type of operation, INSERT or DELETE
         # params: tuple of operation params, (index, string) or (index, count)
+        # For BATCH, a list of (index, deleted string, inserted string) sorted
+        # by index, with indices into the document before the batch
+        # Large deleted strings are kept as read-only Ropes sharing the nodes
+        # of the deleted text instead of copies, see TextEditor.payload
         self.tp = tp
         self.params = params
         self.next:Operation|None = None # For stack
+        self.prev:Operation|None = None # Newer operation, to drop the oldest
+        # Root of the rope before and after the operation, only set when
+        # undo jumps between versions (see TextEditor)
+        self.before = None
+        self.after = None
+    def size(self):
+        # Return the number of chars held by the operation
+        if self.tp == Operation.BATCH:
+            return sum(len(deleted) + len(st) for _, deleted, st in self.params)
+        return len(self.params[1])
 
 class OperationStack:
     # Class representing a stack of operations for undo and redo
-    def __init__(self):
+    # max_ops and max_size (total chars held by the operations) bound the
+    # stack, the oldest operations are dropped when a push exceeds them
+    __slots__ = ('head', 'tail', 'count', 'total', 'max_ops', 'max_size')
+    def __init__(self, max_ops=None, max_size=None):
         self.head = None
+        self.tail = None
+        self.count = 0
+        self.total = 0
+        self.max_ops = max_ops
+        self.max_size = max_size
     def push(self, tp:int, params):
         op = Operation(tp, params)
         self.push_op(op)
     def push_op(self, op: Operation):
         op.next = self.head
+        op.prev = None
+        if self.head != None:
+            self.head.prev = op
+        else:
+            self.tail = op
         self.head = op
+        self.count += 1
+        self.total += op.size()
+        # Never drop the operation just pushed
+        while self.count > 1 and (
+                (self.max_ops != None and self.count > self.max_ops) or
+                (self.max_size != None and self.total > self.max_size)):
+            self.drop_oldest()
+    def drop_oldest(self):
+        tmp = self.tail
+        self.tail = tmp.prev
+        self.tail.next = None
+        tmp.prev = None
+        self.count -= 1
+        self.total -= tmp.size()
     def peek(self):
         return self.head
     def pop(self):
         tmp = self.head
         if self.head != None:
             self.head = self.head.next
+            if self.head != None:
+                self.head.prev = None
+            else:
+                self.tail = None
+            tmp.next = None
+            self.count -= 1
+            self.total -= tmp.size()
             return tmp
         else:
             return None
@@ -31,6 +92,9 @@ class OperationStack:
         return self.head == None
     def clear(self):
         self.head = None
+        self.tail = None
+        self.count = 0
+        self.total = 0
 
 def fibonacci(n):
     if n < 3:
@@ -45,142 +109,842 @@ def fibonacci(n):
         i += 1
     return cur
 
+# Leaf size policy: leaves hold at most maxlen chars, and a leaf shorter than
+# maxlen // 2 is undersized and gets merged with its neighbour when an edit
+# touches it. Editing small leaves is cheap but every leaf costs two objects,
+# LEAF_SIZE is the default used by TextEditor
+LEAF_SIZE = 1024
+
+class RopeStats:
+    # Counters for opt-in instrumentation, see TextEditor.enable_stats.
+    # Nodes are built by static methods, so the counters are process wide
+    # nodes, leaves: internal and leaf nodes allocated
+    # split_leaves: leaves created by splitting a leaf
+    # rotations: AVL rotations done by balance_node
+    # leaf_edits: edits done inside a single leaf, see Rope.edit_leaf
+    # counts, times: number of calls and total seconds per timed event,
+    # such as 'edit', 'undo', 'search' and 'rebalance'
+    # callback: called as callback(event, seconds) after each timed event,
+    # to export metrics
+    __slots__ = ('nodes', 'leaves', 'split_leaves', 'rotations', 'leaf_edits', 'counts', 'times', 'callback')
+    def __init__(self, callback=None):
+        self.nodes = 0
+        self.leaves = 0
+        self.split_leaves = 0
+        self.rotations = 0
+        self.leaf_edits = 0
+        self.counts:dict[str, int] = {}
+        self.times:dict[str, float] = {}
+        self.callback = callback
+    def record(self, event, seconds):
+        self.counts[event] = self.counts.get(event, 0) + 1
+        self.times[event] = self.times.get(event, 0.0) + seconds
+        if self.callback != None:
+            self.callback(event, seconds)
+    def as_dict(self):
+        return {
+            'nodes_allocated': self.nodes,
+            'leaves_allocated': self.leaves,
+            'split_leaves': self.split_leaves,
+            'rotations': self.rotations,
+            'leaf_edits': self.leaf_edits,
+            'counts': dict(self.counts),
+            'times': dict(self.times),
+        }
+
+def timed(event):
+    # Decorator recording the duration of every call as event in Rope.stats,
+    # when stats are enabled. When they are not, the cost is one extra call
+    def wrap(func):
+        @functools.wraps(func)
+        def timed_func(*args, **kwargs):
+            stats = Rope.stats
+            if stats == None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats.record(event, time.perf_counter() - start)
+        return timed_func
+    return wrap
+
+class AhoCorasick:
+    # Automaton matching many patterns in a single pass over a text
+    # goto: per state dict from char to next state, state 0 is the root
+    # fail: per state, the state for the longest proper suffix in the trie
+    # out: per state, the patterns that end at this state
+    __slots__ = ('goto', 'fail', 'out')
+    def __init__(self, patterns):
+        self.goto:list[dict] = [{}]
+        self.fail:list[int] = [0]
+        self.out:list[list[str]] = [[]]
+        # Build the trie, empty and repeated patterns are ignored
+        for pat in dict.fromkeys(patterns):
+            if len(pat) == 0:
+                continue
+            state = 0
+            for ch in pat:
+                nxt = self.goto[state].get(ch)
+                if nxt == None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                state = nxt
+            self.out[state].append(pat)
+        # Breadth first over the trie to set the failure links, a state
+        # also outputs everything its failure state outputs
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0) if state else 0
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+    def search_chunks(self, chunks):
+        # Generator over (index, pattern) for every occurrence of every
+        # pattern in the text made of the strings in chunks, in order of
+        # the end of the match. The automaton state carries over from one
+        # chunk to the next, so matches across chunk boundaries are found
+        goto = self.goto
+        fail = self.fail
+        out = self.out
+        state = 0
+        base = 0
+        for chunk in chunks:
+            for i, ch in enumerate(chunk):
+                while state and ch not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(ch, 0)
+                if out[state]:
+                    for pat in out[state]:
+                        yield base + i - len(pat) + 1, pat
+            base += len(chunk)
+
+class RopeLeaf:
+    # Leaf node of a rope, holds a non empty str of at most maxlen chars
+    # depth and leaves are constant for leaves, so they live on the class.
+    # Leaves are told apart from internal nodes by depth == 0, which does
+    # not touch str (MappedRopeLeaf decodes it on every access)
+    __slots__ = ('str', 'length', 'lines')
+    depth = 0
+    leaves = 1
+    def __init__(self, st):
+        self.str:str = st
+        self.length:int = len(st)
+        self.lines:int = st.count('\n')
+    @property
+    def nbytes(self):
+        # Size of the text in UTF-8, computed on demand, Utf8RopeLeaf keeps it
+        text = self.str
+        if text.isascii():
+            return self.length
+        return len(text.encode('utf-8', 'surrogatepass'))
+
+class RopeNode:
+    # Internal node of a rope, both children are always present
+    # length: total number of chars, leaves: number of leaf nodes
+    # depth: height of the node, leaves have depth 0
+    # lines: number of newlines, in leaves as well
+    # The weight of the node (chars in the left subrope) is left.length
+    __slots__ = ('left', 'right', 'length', 'leaves', 'depth', 'lines')
+    # Internal nodes never hold a string
+    str = None
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+        self.length:int = left.length + right.length
+        self.leaves:int = left.leaves + right.leaves
+        self.depth:int = max(left.depth, right.depth) + 1
+        self.lines:int = left.lines + right.lines
+    @property
+    def nbytes(self):
+        # Size of the text in UTF-8, computed on demand by walking the whole
+        # subtree, Utf8RopeNode keeps it
+        return self.left.nbytes + self.right.nbytes
+
+# Number of bytes of a memory mapped file held by each MappedRopeLeaf
+MAPPED_LEAF_BYTES = 1 << 16
+
+class MappedRopeLeaf:
+    # Leaf node over the bytes data[begin:end] of a memory mapped file, in
+    # the style of a piece table. The bytes are decoded every time str is
+    # read and the result is not kept, so reading or searching the whole
+    # document does not pin its text in memory. Mapped leaves may be longer
+    # than maxlen, edits cut the parts they touch into ordinary leaves,
+    # which keep their text
+    __slots__ = ('data', 'begin', 'end', 'encoding', 'length', 'lines')
+    depth = 0
+    leaves = 1
+    def __init__(self, data, begin, end, encoding, length, lines):
+        self.data = data
+        self.begin:int = begin
+        self.end:int = end
+        self.encoding:str = encoding
+        self.length:int = length
+        self.lines:int = lines
+    @property
+    def str(self):
+        return str(self.data[self.begin:self.end], self.encoding)
+    @property
+    def nbytes(self):
+        if codecs.lookup(self.encoding).name == 'utf-8':
+            return self.end - self.begin
+        return RopeLeaf.nbytes.fget(self)
+
+class Utf8RopeLeaf:
+    # Leaf node holding its text encoded in UTF-8, used while UTF-8 mode is
+    # enabled (see Rope.set_utf8). A str is as wide as its widest char, so a
+    # single emoji makes a leaf take 4 bytes per char, while UTF-8 takes 1
+    # byte per ASCII char. str decodes data on every access.
+    # data: bytes, or a memoryview of a file mapped by Rope.from_file
+    # length: number of chars, nbytes: number of bytes
+    __slots__ = ('data', 'length', 'nbytes', 'lines')
+    depth = 0
+    leaves = 1
+    def __init__(self, st):
+        # Lone surrogates are kept, as str leaves keep them
+        self.data = st.encode('utf-8', 'surrogatepass')
+        self.length:int = len(st)
+        self.nbytes:int = len(self.data)
+        self.lines:int = st.count('\n')
+    @staticmethod
+    def from_utf8(data):
+        # Return a leaf over the UTF-8 bytes data without copying them, data
+        # is decoded once to count its chars
+        leaf = Utf8RopeLeaf.__new__(Utf8RopeLeaf)
+        text = str(data, 'utf-8')
+        leaf.data = data
+        leaf.length = len(text)
+        leaf.nbytes = len(data)
+        leaf.lines = text.count('\n')
+        return leaf
+    @property
+    def str(self):
+        return str(self.data, 'utf-8', 'surrogatepass')
+
+class Utf8RopeNode(RopeNode):
+    # RopeNode that also keeps the UTF-8 size of its text, used while UTF-8
+    # mode is enabled, so that byte offsets are found in O(log n)
+    # size: UTF-8 size, None if a child is a RopeNode (built before the mode
+    # was enabled), whose size takes a walk of its subtree. Then it is only
+    # computed when nbytes is read, so editing such a tree stays O(log n)
+    __slots__ = ('size',)
+    def __init__(self, left, right):
+        RopeNode.__init__(self, left, right)
+        a = Utf8RopeNode.known_size(left)
+        b = Utf8RopeNode.known_size(right)
+        self.size = None if a == None or b == None else a + b
+    @staticmethod
+    def known_size(node):
+        # UTF-8 size of node if it is cheap to get, a leaf encodes at most
+        # its own text
+        if node.depth == 0:
+            return node.nbytes
+        if isinstance(node, Utf8RopeNode):
+            return node.size
+        return None
+    @property
+    def nbytes(self):
+        if self.size == None:
+            # The size never changes, nodes are immutable
+            self.size = self.left.nbytes + self.right.nbytes
+        return self.size
+
+class DebugRopeLeaf(RopeLeaf):
+    # RopeLeaf with a unique id, used while debug ids are enabled
+    __slots__ = ('id',)
+    def __init__(self, st):
+        RopeLeaf.__init__(self, st)
+        self.id = Rope.counter
+        Rope.counter += 1
+
+class DebugRopeNode(RopeNode):
+    # RopeNode with a unique id, used while debug ids are enabled
+    __slots__ = ('id',)
+    def __init__(self, left, right):
+        RopeNode.__init__(self, left, right)
+        self.id = Rope.counter
+        Rope.counter += 1
+
+class RopeCursor:
+    # Position in one version of a rope. Seeking descends from the root once
+    # in O(log n) and keeps the path, moving to the next or previous leaf
+    # only climbs as far as needed, which is amortized O(1) per leaf.
+    # Nodes are never modified, so a cursor is not affected by later edits
+    # path: internal nodes from the root down to the current leaf
+    # sides: for each node in path, True if the path goes to its right child
+    # leaf: current leaf (None for an empty rope), start: index of its
+    # first char, pos: offset of the cursor inside it
+    # text: str of leaf once read, or None. The str of UTF-8 and mapped
+    # leaves decodes them on every access, so it is read once per leaf
+    __slots__ = ('root', 'path', 'sides', 'leaf', 'start', 'pos', 'text')
+    def __init__(self, root, idx=0):
+        self.root = root
+        self.seek(idx)
+    def seek(self, idx):
+        # Move the cursor to index idx, which may be the length of the rope
+        length = 0 if self.root == None else self.root.length
+        if idx < 0 or idx > length:
+            raise IndexError("Invalid index in seek()")
+        self.path = []
+        self.sides = []
+        self.start = 0
+        node = self.root
+        while node != None and node.depth > 0:
+            weight = node.left.length
+            self.path.append(node)
+            if idx < weight:
+                self.sides.append(False)
+                node = node.left
+            else:
+                self.sides.append(True)
+                idx -= weight
+                self.start += weight
+                node = node.right
+        self.leaf = node
+        self.text = None
+        self.pos = idx
+    def leaf_text(self):
+        # Return the str of the current leaf
+        if self.text == None:
+            self.text = self.leaf.str
+        return self.text
+    def tell(self):
+        # Return the index of the cursor
+        return self.start + self.pos
+    def next_leaf(self):
+        # Move to the start of the next leaf, returns False if there is none
+        path = self.path
+        sides = self.sides
+        depth = len(path)
+        while depth and sides[depth-1]:
+            depth -= 1
+        if depth == 0:
+            return False
+        del path[depth:]
+        del sides[depth:]
+        sides[depth-1] = True
+        node = path[depth-1].right
+        while node.depth > 0:
+            path.append(node)
+            sides.append(False)
+            node = node.left
+        self.start += self.leaf.length
+        self.leaf = node
+        self.text = None
+        self.pos = 0
+        return True
+    def prev_leaf(self):
+        # Move to the end of the previous leaf, returns False if there is none
+        path = self.path
+        sides = self.sides
+        depth = len(path)
+        while depth and not sides[depth-1]:
+            depth -= 1
+        if depth == 0:
+            return False
+        del path[depth:]
+        del sides[depth:]
+        sides[depth-1] = False
+        node = path[depth-1].left
+        while node.depth > 0:
+            path.append(node)
+            sides.append(True)
+            node = node.right
+        self.start -= node.length
+        self.leaf = node
+        self.text = None
+        self.pos = node.length
+        return True
+    def __iter__(self):
+        return self
+    def __next__(self):
+        # Return the char at the cursor and move forward by one
+        if self.leaf == None:
+            raise StopIteration
+        while self.pos == self.leaf.length:
+            if not self.next_leaf():
+                raise StopIteration
+        text = self.text
+        if text == None:
+            text = self.text = self.leaf.str
+        ch = text[self.pos]
+        self.pos += 1
+        return ch
+    def prev(self):
+        # Move back by one and return the char at the cursor
+        if self.leaf == None:
+            raise StopIteration
+        while self.pos == 0:
+            if not self.prev_leaf():
+                raise StopIteration
+        self.pos -= 1
+        text = self.text
+        if text == None:
+            text = self.text = self.leaf.str
+        return text[self.pos]
+    def next_chunk(self):
+        # Return the rest of the current leaf (or the next one if at its
+        # end) and move past it, returns "" at the end of the rope
+        if self.leaf == None:
+            return ""
+        while self.pos == self.leaf.length:
+            if not self.next_leaf():
+                return ""
+        chunk = self.leaf_text()[self.pos:]
+        self.pos = self.leaf.length
+        return chunk
+    def prev_chunk(self):
+        # Return the part of the current leaf before the cursor (or the
+        # previous leaf if at its start) and move before it, returns "" at
+        # the start of the rope
+        if self.leaf == None:
+            return ""
+        while self.pos == 0:
+            if not self.prev_leaf():
+                return ""
+        chunk = self.leaf_text()[:self.pos]
+        self.pos = 0
+        return chunk
+    def chunks(self):
+        # Generator over the text after the cursor, one leaf at a time
+        chunk = self.next_chunk()
+        while chunk:
+            yield chunk
+            chunk = self.next_chunk()
+    def chunks_backward(self):
+        # Generator over the text before the cursor, one leaf at a time from
+        # right to left, each chunk in normal order
+        chunk = self.prev_chunk()
+        while chunk:
+            yield chunk
+            chunk = self.prev_chunk()
+    def read(self, n):
+        # Return up to n chars after the cursor and move past them
+        strb = []
+        while n > 0 and self.leaf != None:
+            while self.pos == self.leaf.length:
+                if not self.next_leaf():
+                    return "".join(strb)
+            chunk = self.leaf_text()[self.pos:self.pos+n]
+            self.pos += len(chunk)
+            n -= len(chunk)
+            strb.append(chunk)
+        return "".join(strb)
+
 class Rope:
+    # Handle on a tree of RopeLeaf and RopeNode objects, root is None for
+    # an empty rope. Nodes are never modified once built: edits copy the
+    # path they walk and replace the root, sharing every other node with
+    # the previous version, so old roots stay valid as snapshots.
+    # finger: RopeCursor on the leaf of the last edit, see edit_leaf
+    __slots__ = ('root', 'maxlen', 'finger')
+    # Counter for debug ids, see set_debug_ids
     counter = 0
-    def __init__(self, maxlen=5):
+    debug_ids = False
+    # UTF-8 leaves, see set_utf8
+    utf8 = False
+    # RopeStats while instrumentation is enabled, see set_stats
+    stats:RopeStats|None = None
+    # Node classes (or factories, see set_stats) used to build new trees
+    leaf_class = RopeLeaf
+    node_class = RopeNode
+    def __init__(self, maxlen=LEAF_SIZE, root=None):
         # maxlen: maximum length of each fixed len str in the rope
-        self.left:None|Rope = None
-        self.right:None|Rope = None
-        # If str is None, internal node, else leaf node
-        self.str:None|str = None
-        self.strlen:int = 0
+        self.root:RopeLeaf|RopeNode|None = root
         self.maxlen:int = maxlen
-        # Ignore this, for debugging only
-        self.id = Rope.counter
-        Rope.counter += 1
+        self.finger:RopeCursor|None = None
+    @staticmethod
+    def set_debug_ids(enabled):
+        # Give every node created from now on a unique id for print_debug.
+        # Off by default since the id costs a slot on every node
+        Rope.debug_ids = enabled
+        Rope.update_factories()
+    @staticmethod
+    def set_utf8(enabled):
+        # Store the text of the leaves created from now on as UTF-8 (see
+        # Utf8RopeLeaf), and keep the UTF-8 size of every node. Ropes built
+        # before keep their leaves and nodes, whose UTF-8 size is computed by
+        # encoding their whole subtree each time a byte offset needs it, so
+        # switch before opening or building documents. Editing them stays
+        # O(log n), see Utf8RopeNode. Debug ids are not given in this mode
+        Rope.utf8 = enabled
+        Rope.update_factories()
+    @staticmethod
+    def set_stats(stats):
+        # Enable instrumentation with the RopeStats stats, or disable it if
+        # stats is None. While enabled nodes are built through factories that
+        # count them, when disabled the node classes are used directly
+        Rope.stats = stats
+        Rope.update_factories()
+    @staticmethod
+    def update_factories():
+        if Rope.utf8:
+            leaf, node = Utf8RopeLeaf, Utf8RopeNode
+        elif Rope.debug_ids:
+            leaf, node = DebugRopeLeaf, DebugRopeNode
+        else:
+            leaf, node = RopeLeaf, RopeNode
+        stats = Rope.stats
+        if stats == None:
+            Rope.leaf_class = leaf
+            Rope.node_class = node
+            return
+        def counted_leaf(st):
+            stats.leaves += 1
+            return leaf(st)
+        def counted_node(left, right):
+            stats.nodes += 1
+            return node(left, right)
+        Rope.leaf_class = staticmethod(counted_leaf)
+        Rope.node_class = staticmethod(counted_node)
     @staticmethod
-    def from_string(st: str, start:int=0, end:int=None, maxlen=5):
-        # Returns a balanced head node for rope with the string st
+    def from_string(st: str, start:int=0, end:int=None, maxlen=LEAF_SIZE):
+        # Returns a balanced rope with the string st
         # maxlen: maximum length of each fixed len str in the rope
         # start and end: bounds of the string to be included in the rope
         if end == None:
             end = len(st)
+        return Rope(maxlen, Rope.build(st, start, end, maxlen))
+    @staticmethod
+    def from_file(path, maxlen=LEAF_SIZE, encoding='utf-8'):
+        # Returns a rope over the contents of the file at path, which is
+        # memory mapped. Leaves reference byte ranges of the mapping and are
+        # only decoded when read, so memory stays small whatever the file
+        # size. Opening still reads the file once, at C speed, to count the
+        # chars and newlines of every leaf.
+        # encoding must be UTF-8 or a single byte encoding, the text is used
+        # as is, without newline translation.
+        # In UTF-8 mode (see set_utf8) a UTF-8 file is not decoded again,
+        # leaves are Utf8RopeLeaf over memoryviews of the mapping
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return Rope(maxlen)
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = None
+        if Rope.utf8 and codecs.lookup(encoding).name == 'utf-8':
+            view = memoryview(data)
+        leaflist = []
+        begin = 0
+        while begin < size:
+            end = min(begin + MAPPED_LEAF_BYTES, size)
+            # Move the cut back so that it does not split a UTF-8 sequence
+            while end < size and end > begin + 1 and data[end] & 0xC0 == 0x80:
+                end -= 1
+            if view != None:
+                leaflist.append(Utf8RopeLeaf.from_utf8(view[begin:end]))
+            else:
+                text = str(data[begin:end], encoding)
+                leaflist.append(MappedRopeLeaf(data, begin, end, encoding, len(text), text.count('\n')))
+            begin = end
+        return Rope(maxlen, Rope.from_leaflist(leaflist, 0, len(leaflist), maxlen))
+    def save(self, path, encoding='utf-8'):
+        # Write the rope to the file at path, one leaf at a time. Leaves
+        # still mapped from a file in the same encoding, and UTF-8 leaves when
+        # saving as UTF-8, are written without decoding them. The text goes to a temporary file
+        # in the same directory that then replaces path, so path is never
+        # left half written, and a rope mapped from path stays readable
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path), suffix='.tmp')
+        utf8 = codecs.lookup(encoding).name == 'utf-8'
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for leaf in Rope.iter_leaves(self.root):
+                    if utf8 and isinstance(leaf, Utf8RopeLeaf):
+                        f.write(leaf.data)
+                    elif isinstance(leaf, MappedRopeLeaf) and leaf.encoding == encoding:
+                        with memoryview(leaf.data) as view:
+                            f.write(view[leaf.begin:leaf.end])
+                    else:
+                        f.write(leaf.str.encode(encoding))
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp creates the file with mode 0600, use the mode of the
+            # file being replaced, or the default mode for a new file
+            if os.path.exists(path):
+                os.chmod(tmp, os.stat(path).st_mode & 0o7777)
+            else:
+                umask = os.umask(0)
+                os.umask(umask)
+                os.chmod(tmp, 0o666 & ~umask)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    @staticmethod
+    def build(st: str, start:int, end:int, maxlen:int):
+        # Returns the root node of a balanced tree holding st[start:end],
+        # or None if the range is empty
+        leaflist = []
+        Rope.cut_leaves(st, start, end, maxlen, leaflist)
+        return Rope.from_leaflist(leaflist, 0, len(leaflist), maxlen)
+    @staticmethod
+    def cut_leaves(st: str, start:int, end:int, maxlen:int, leaflist):
+        # Append to leaflist the fewest leaves that hold st[start:end], with
+        # the chars spread evenly so that no leaf is undersized unless the
+        # whole range is
         length = end-start
-        if length <= maxlen:
-            # Base case, return a single leaf node with the given string
-            if length <= 0:
-                return None
-            rp = Rope(maxlen)
-            rp.str = st[start:end]
-            rp.strlen = length
-            return rp
-        else:
-            # Recursive case
-            # Split the string in two and generate a rope from each subrope
-            rp = Rope(maxlen)
-            strlen = length
-            idx = strlen//2
-            # Create a rope with left subrope as the first substring
-            # and right subrope as second substring
-            rp.left = Rope.from_string(st, start, start+length//2, maxlen)
-            rp.right = Rope.from_string(st, start+length//2, end, maxlen)
-            rp.strlen = idx
-            return rp
+        if length <= 0:
+            return
+        count = -(-length // maxlen)
+        size, extra = divmod(length, count)
+        leaf = Rope.leaf_class
+        for i in range(count):
+            step = size + 1 if i < extra else size
+            leaflist.append(leaf(st[start:start+step]))
+            start += step
+    @staticmethod
+    def from_chunks(chunks, maxlen=LEAF_SIZE):
+        # Returns a balanced rope with the text made of the strings in
+        # chunks, which may be any iterable, such as a file opened in text
+        # mode. Leaves are cut as the chunks arrive, so only the leaves and
+        # less than maxlen pending chars are held, and the tree is then
+        # built bottom up. The cost is linear in the length of the text
+        leaflist = []
+        leaf = Rope.leaf_class
+        pending = ""
+        for chunk in chunks:
+            buf = pending + chunk if pending else chunk
+            full = len(buf) - len(buf) % maxlen
+            for i in range(0, full, maxlen):
+                leaflist.append(leaf(buf[i:i+maxlen]))
+            pending = buf[full:]
+        if pending:
+            if leaflist and len(pending) < maxlen // 2:
+                # Share the chars of the last full leaf with the remainder
+                pending = leaflist.pop().str + pending
+            Rope.cut_leaves(pending, 0, len(pending), maxlen, leaflist)
+        return Rope(maxlen, Rope.from_leaflist(leaflist, 0, len(leaflist), maxlen))
     def get_length(self):
         # Return the length of this rope
-        if self.str != None:
-            # Leaf node, base case
-            return self.strlen
-        else:
-            # Recursive case, return the length of left side
-            # plus length of right side
-            l = self.strlen
-            if self.right != None:
-                l += self.right.get_length()
-            return l
+        return 0 if self.root == None else self.root.length
+    def get_leaf_count(self):
+        # Return the number of leaves in this rope
+        return 0 if self.root == None else self.root.leaves
     def insert_string(self, idx, st):
         # Insert string st at index idx
-        rp = Rope.from_string(st, maxlen = self.maxlen)
-        # Split current rope at idx
-        rs = self.split(idx)
-        # Concatenate the string
-        self.concat(rp)
-        # Concatenate the string that was removed
-        self.concat(rs)
-        self.rebalance()
+        if not self.edit_leaf(idx, 0, st):
+            self.root = Rope.splice(self.root, idx, 0, st, self.maxlen)
     def delete_chars(self, idx, n):
         # Delete n chars from index idx
         # idx: index to remove from
         # n: number of chars to remove
-
-        # Split rope at idx and remove all chars starting at idx
-        tail = self.split(idx)
-        if tail == None:
-            self.rebalance
-            return
-        # Separate all chars after index idx+n
-        tail_of_tail = tail.split(n)
-        # Concatenate chars after idx+n back to original rope
-        if tail_of_tail != None:
-            self.concat(tail_of_tail)
-        self.rebalance()
+        if not self.edit_leaf(idx, n, ""):
+            self.root = Rope.splice(self.root, idx, n, "", self.maxlen)
+    def edit_leaf(self, idx, n, st):
+        # Replace n chars at idx with st if they are all in one leaf and the
+        # leaf stays within maxlen chars without becoming undersized. Only
+        # the leaf and the nodes on the path from the root to it are copied,
+        # there is no split, join or rotation since no depth changes.
+        # The path is kept in finger, so an edit in the same leaf as the
+        # previous one, such as typing, does not descend from the root.
+        # Nodes are shared with older versions and are never modified, so
+        # the path is still copied. Returns False, changing nothing, if the
+        # edit does not fit in one leaf
+        root = self.root
+        if root == None or idx < 0 or n < 0 or idx + n > root.length:
+            return False
+        finger = self.finger
+        if finger == None or finger.root is not root or idx < finger.start or idx + n > finger.start + finger.leaf.length:
+            finger = RopeCursor(root, idx)
+        leaf = finger.leaf
+        pos = idx - finger.start
+        length = leaf.length - n + len(st)
+        if pos + n > leaf.length or length > self.maxlen:
+            return False
+        if length < self.maxlen // 2 and length < leaf.length and root.depth > 0:
+            return False
+        # An emptied document has no root, not an empty leaf
+        if length == 0:
+            return False
+        text = finger.leaf_text()
+        text = text[:pos] + st + text[pos+n:]
+        node = Rope.leaf_class(text)
+        finger.leaf = node
+        finger.text = text
+        path = finger.path
+        sides = finger.sides
+        for i in range(len(path) - 1, -1, -1):
+            parent = path[i]
+            if sides[i]:
+                node = Rope.node_class(parent.left, node)
+            else:
+                node = Rope.node_class(node, parent.right)
+            path[i] = node
+        finger.root = node
+        finger.pos = pos + len(st)
+        self.root = node
+        self.finger = finger
+        if Rope.stats != None:
+            Rope.stats.leaf_edits += 1
+        return True
+    def apply_edits(self, edits):
+        # Apply a list of edits (index, count, string), each replacing count
+        # chars at index with string. Indices refer to the rope before any
+        # of the edits, and the edits must be sorted by index and must not
+        # overlap. They are applied from the last to the first, so earlier
+        # indices stay valid without adjusting them, in O(k log n) in total
+        root = self.root
+        for idx, n, st in reversed(edits):
+            root = Rope.splice(root, idx, n, st, self.maxlen)
+        self.root = root
     def get_substring(self, idx, n):
         # Get n characters starting from index idx
-        if self.str == None:
-            # Recursive case, either idx is in the left side, right side or splits
-            # left and right side perfectly
-
-            # li is None if idx is on the right side
-            li = idx if idx < self.strlen else None
-            ln = min(n, self.strlen-idx)
-            if idx >= self.strlen:
-                # Completely in right side
-                ri = idx - self.strlen
-            elif idx + n-1 >= self.strlen:
-                # Partially in right side
-                ri = 0
-            else:
-                # Left side only
-                ri = None
-            rn = n if idx >= self.strlen else n - (self.strlen - idx)
-
-            if li != None and self.left == None:
-                raise IndexError("Invalid index in get_substring()")
-            elif ri != None and self.right == None:
-                raise IndexError("Invalid index in get_substring()")
-
-            # Retrieve the part of substring from left and right side if they exist
-            # Concatenate and return
-            left_str = "" if li == None else self.left.get_substring(li, ln)
-            right_str = "" if ri == None else self.right.get_substring(ri, rn)
-            return left_str + right_str
-        else:
-            # Base case, leaf node
-            if idx > self.strlen or idx + n > self.strlen: # Corrected condition
-                raise IndexError("Invalid index used with get_substring()")
-            else:
-                return self.str[idx:idx+n]
+        if idx < 0 or n < 0 or idx + n > self.get_length():
+            raise IndexError("Invalid index in get_substring()")
+        return RopeCursor(self.root, idx).read(n)
     def get_string(self):
         # Return the entire string
-        strb = []
-        if self.str == None:
-            # Recursive case
-            # Concatenate left and right substrings and return
-            if self.left != None:
-                strb.append(self.left.get_string())
-            if self.right != None:
-                strb.append(self.right.get_string())
-        else:
-            # Base case, return string stored in leaf node
-            strb.append(self.str)
-        return "".join(strb)
+        return "".join(Rope.iter_chunks(self.root))
+    def get_subrope(self, idx, n):
+        # Return the n chars starting from index idx as a read-only Rope, in
+        # O(log n). It shares the nodes of this rope instead of copying text
+        if idx < 0 or n < 0 or idx + n > self.get_length():
+            raise IndexError("Invalid index in get_subrope()")
+        _, tail = Rope.split_node(self.root, idx)
+        mid, _ = Rope.split_node(tail, n)
+        return RopeSnapshot(self.maxlen, mid)
+    def __len__(self):
+        return self.get_length()
+    def cursor(self, idx=0):
+        # Return a RopeCursor at index idx over the current version
+        return RopeCursor(self.root, idx)
+    @staticmethod
+    def iter_leaves(node):
+        # Generator over the leaves of the subrope node, from left to right
+        cursor = RopeCursor(node, 0)
+        while cursor.leaf != None:
+            yield cursor.leaf
+            if not cursor.next_leaf():
+                break
+    @staticmethod
+    def iter_chunks(node):
+        # Generator over the strings held by the leaves of the subrope node,
+        # in order from left to right, using O(depth) memory
+        return RopeCursor(node, 0).chunks()
+    @staticmethod
+    def find_chunks(chunks, sub):
+        # Generator over the starting indices of sub in the text made of the
+        # strings in chunks. Each chunk is searched with str.find after the
+        # last len(sub)-1 chars of the text before it, so matches crossing
+        # a chunk boundary are found and memory stays O(maxlen + len(sub))
+        if len(sub) == 0:
+            return
+        keep = len(sub) - 1
+        carry = ""
+        # Index of the first char of carry in the text
+        base = 0
+        for chunk in chunks:
+            buf = carry + chunk
+            pos = buf.find(sub)
+            while pos != -1:
+                yield base + pos
+                pos = buf.find(sub, pos + 1)
+            carry = buf[max(len(buf) - keep, 0):] if keep else ""
+            base += len(buf) - len(carry)
+    @staticmethod
+    def find_regex_chunks(chunks, pattern, max_match):
+        # Generator over (index, matched string) for the non empty matches
+        # of the compiled regex pattern in the text made of the strings in
+        # chunks. Chunks are appended to a window, matches ending in the
+        # last max_match chars of the window are held back until more text
+        # arrives. The search resumes after the last match, or after the
+        # text known to hold no match, and only max_match chars before that
+        # point are kept, so ^, \b and lookbehinds see the real preceding
+        # text while memory stays O(maxlen + max_match). Matches longer than
+        # max_match chars, or assertions reaching further than max_match
+        # chars, may be missed near chunk boundaries
+        buf = ""
+        # Index of the first char of buf in the text, and position in buf
+        # to resume searching from
+        base = 0
+        pos = 0
+        chunks = iter(chunks)
+        chunk = next(chunks, None)
+        while chunk != None:
+            buf += chunk
+            chunk = next(chunks, None)
+            last = chunk == None
+            if not last and len(buf) < 2 * max_match:
+                continue
+            limit = len(buf) if last else len(buf) - max_match
+            held = False
+            for m in pattern.finditer(buf, pos):
+                if not last and m.end() > limit:
+                    # Resume at this match once more text is there
+                    pos = m.start()
+                    held = True
+                    break
+                if m.end() > m.start():
+                    yield base + m.start(), m.group()
+                pos = m.end()
+            if not held:
+                # No match starts between pos and limit
+                pos = max(pos, limit)
+            drop = max(pos - max_match, 0)
+            buf = buf[drop:]
+            base += drop
+            pos -= drop
+    def find_iter(self, sub):
+        # Generator over the starting indices of sub in this rope
+        return Rope.find_chunks(Rope.iter_chunks(self.root), sub)
+    def find_many_iter(self, patterns):
+        # Generator over (index, pattern) for all the patterns in one pass
+        return AhoCorasick(patterns).search_chunks(Rope.iter_chunks(self.root))
+    def find_regex_iter(self, pattern, max_match=LEAF_SIZE):
+        # Generator over (index, matched string) for the regex pattern, a
+        # str or compiled pattern
+        return Rope.find_regex_chunks(Rope.iter_chunks(self.root), re.compile(pattern), max_match)
     def get_depth(self):
-        if self.str == None:
+        return 0 if self.root == None else self.root.depth
+    def get_line_count(self):
+        # Return the number of lines, one more than the number of newlines
+        return 1 if self.root == None else self.root.lines + 1
+    def newlines_before(self, idx):
+        # Return the number of newlines in the first idx chars, in O(log n)
+        if idx < 0 or idx > self.get_length():
+            raise IndexError("Invalid index in newlines_before()")
+        count = 0
+        node = self.root
+        while node != None and node.depth > 0:
+            weight = node.left.length
+            if idx < weight:
+                node = node.left
+            else:
+                count += node.left.lines
+                idx -= weight
+                node = node.right
+        if node != None:
+            count += node.str.count('\n', 0, idx)
+        return count
+    def line_start(self, line):
+        # Return the index of the first char of line (counting from 0),
+        # found by descending to the leaf holding the line-th newline
+        if line < 0 or line >= self.get_line_count():
+            raise IndexError("Invalid line in line_start()")
+        if line == 0:
             return 0
-        else:
-            ld = -1 if self.left == None else self.left.get_depth()
-            rd = -1 if self.right == None else self.right.get_depth()
-            return max(ld, rd) + 1
+        idx = 0
+        node = self.root
+        while node.depth > 0:
+            if line <= node.left.lines:
+                node = node.left
+            else:
+                line -= node.left.lines
+                idx += node.left.length
+                node = node.right
+        # Decoded once, str of UTF-8 and mapped leaves decodes on every access
+        text = node.str
+        pos = -1
+        for _ in range(line):
+            pos = text.find('\n', pos + 1)
+        return idx + pos + 1
     def is_balanced(self):
         depth = self.get_depth()
         len = self.get_length()
@@ -188,168 +952,704 @@ class Rope:
         return len >= fibonacci(depth + 2)
 
     @staticmethod
-    def from_leaflist(leaflist: list[any], start: int, end: int, maxlen:int=5) -> any:
-        # Create a rope from the list of leaves given, similar to from_string
-        count = end-start
-        if count == 0:
+    def from_leaflist(leaflist: list[any], start: int, end: int, maxlen:int=LEAF_SIZE) -> any:
+        # Create a balanced tree from leaflist[start:end], without recursion.
+        # The tree is built bottom up, pairing the nodes of each level into
+        # the next one. With an odd count the last three nodes are combined
+        # into one, so every level holds nodes of the same depth except
+        # possibly the last one, which is one deeper, keeping the tree AVL
+        # balanced. Builds n leaves into a tree in O(n)
+        if end - start == 0:
             return
-        elif count == 1:
-            # Single leaf, return as a rope
-            return leaflist[start]
-        elif count == 2:
-            # Two leaves, combine into a rope with an internal node
-            rp = Rope(maxlen)
-            rp.left = leaflist[start]
-            rp.right = leaflist[start+1]
-            rp.strlen = rp.left.strlen
-            return rp
-        else:
-            # Any number of leaves, create left and right subropes, combine and return
-            rp = Rope(maxlen)
-            rp.left = Rope.from_leaflist(leaflist, start, start + count//2, maxlen)
-            rp.right = Rope.from_leaflist(leaflist, start + count//2, end, maxlen)
-            rp.strlen = rp.left.get_length()
-            return rp
+        node = Rope.node_class
+        level = leaflist[start:end]
+        while len(level) > 1:
+            count = len(level)
+            pairs = count - 3 if count % 2 else count
+            upper = [node(level[i], level[i+1]) for i in range(0, pairs, 2)]
+            if count % 2:
+                upper.append(node(node(level[-3], level[-2]), level[-1]))
+            level = upper
+        return level[0]
 
+    @timed('rebalance')
     def rebalance(self):
+        # Edits keep the rope balanced through rotations, a full rebuild
+        # is only needed if the rope was assembled by hand
+        if self.is_balanced():
+            return
         leaflist = []
         self.collect_leaves(leaflist)
         # Construct the rope from the ground-up
-        rp = Rope.from_leaflist(leaflist, 0, len(leaflist), self.maxlen)
-        # Copy the newly created rope to the current one
-        Rope.copy(rp, self)
+        self.root = Rope.from_leaflist(leaflist, 0, len(leaflist), self.maxlen)
 
     def collect_leaves(self, leaflist):
         # Add all leaves in this rope to the list leaflist, in 
         # order from left to right
-        if self.str != None and self.strlen > 0:
-            # Base case, current node is a leaf node, append the current
-            # node to the list
-            leaflist.append(self)
+        if self.root == None:
             return
-        # Recursive case, append all leaves in left sub-rope and then
-        # right sub-rope
-        if self.left != None:
-            self.left.collect_leaves(leaflist)
-        if self.right != None:
-            self.right.collect_leaves(leaflist)
+        # Walk the tree with an explicit stack, pushing the right child
+        # first so that the left one is visited first
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.depth == 0:
+                leaflist.append(node)
+            else:
+                stack.append(node.right)
+                stack.append(node.left)
 
     @staticmethod
     def copy(fr, to):
-        if fr == None:
-            to.left = None
-            to.right = None
-            to.str = None
-            to.strlen = 0
-            return
-        to.left = fr.left
-        to.right = fr.right
-        to.str = fr.str
-        to.strlen = fr.strlen
+        # Make the rope to hold the same string as the rope fr (or an empty
+        # string if fr is None), the tree itself is shared
+        to.root = None if fr == None else fr.root
+
+    @staticmethod
+    def balance_node(left, right):
+        # Create an internal node over left and right whose depths differ
+        # by at most 2, applying a single or double AVL rotation if needed
+        node = Rope.node_class
+        if left.depth > right.depth + 1:
+            if Rope.stats != None:
+                Rope.stats.rotations += 1
+            if left.left.depth >= left.right.depth:
+                return node(left.left, node(left.right, right))
+            lr = left.right
+            return node(node(left.left, lr.left), node(lr.right, right))
+        if right.depth > left.depth + 1:
+            if Rope.stats != None:
+                Rope.stats.rotations += 1
+            if right.right.depth >= right.left.depth:
+                return node(node(left, right.left), right.right)
+            rl = right.left
+            return node(node(left, rl.left), node(rl.right, right.right))
+        return node(left, right)
+
+    @staticmethod
+    def join(a, b):
+        # Concatenate the subropes a and b (either may be None) and return
+        # the balanced result. Descends the spine of the taller rope until
+        # the depths match, so the cost is O(|a.depth - b.depth| + 1)
+        if a == None:
+            return b
+        if b == None:
+            return a
+        if a.depth > b.depth + 1:
+            return Rope.balance_node(a.left, Rope.join(a.right, b))
+        if b.depth > a.depth + 1:
+            return Rope.balance_node(Rope.join(a, b.left), b.right)
+        return Rope.node_class(a, b)
+
+    @staticmethod
+    def split_node(node, idx):
+        # Split the subrope node at idx and return the pair (left, right),
+        # either of which may be None. The pieces are joined back on the way
+        # up, which costs O(log n) in total
+        if node == None:
+            if idx != 0:
+                raise IndexError('Invalid index in split')
+            return None, None
+        if node.depth == 0:
+            # Base case, leaf node
+            if idx < 0 or idx > node.length:
+                raise IndexError('Invalid index in split')
+            if idx == 0:
+                return None, node
+            if idx == node.length:
+                return node, None
+            if Rope.stats != None:
+                Rope.stats.split_leaves += 2
+            text = node.str
+            return Rope.leaf_class(text[:idx]), Rope.leaf_class(text[idx:])
+        weight = node.left.length
+        if idx == weight:
+            # Split is exactly between left and right child
+            return node.left, node.right
+        elif idx < weight:
+            left, right = Rope.split_node(node.left, idx)
+            return left, Rope.join(right, node.right)
+        else:
+            left, right = Rope.split_node(node.right, idx - weight)
+            return Rope.join(node.left, left), right
+
+    @staticmethod
+    def first_leaf(node):
+        # Return the leftmost leaf of the subrope node
+        while node.depth > 0:
+            node = node.left
+        return node
+
+    @staticmethod
+    def last_leaf(node):
+        # Return the rightmost leaf of the subrope node
+        while node.depth > 0:
+            node = node.right
+        return node
+
+    @staticmethod
+    def splice(node, idx, n, st, maxlen):
+        # Replace n chars starting at idx in the subrope node with st and
+        # return the new subrope. The rope is split at idx and idx+n, and the
+        # leaves on either side of the cut are merged into the new text if
+        # they are undersized (or the new text is), so edits never leave
+        # tiny leaves behind. build cuts the merged text back into
+        # leaves of at most maxlen chars.
+        # Split and join walk a single path, so this is O(log n + maxlen)
+        # st may also be a Rope, whose tree is then inserted as is, sharing
+        # its nodes, and only the leaves at the two seams are merged
+        minlen = maxlen // 2
+        left, tail = Rope.split_node(node, idx)
+        _, right = Rope.split_node(tail, n)
+        if isinstance(st, Rope):
+            return Rope.join_merge(Rope.join_merge(left, st.root, maxlen), right, maxlen)
+        if left != None:
+            leaf = Rope.last_leaf(left)
+            if leaf.length < minlen or len(st) < minlen:
+                left, _ = Rope.split_node(left, left.length - leaf.length)
+                st = leaf.str + st
+        if right != None:
+            leaf = Rope.first_leaf(right)
+            if leaf.length < minlen or len(st) < minlen:
+                _, right = Rope.split_node(right, leaf.length)
+                st = st + leaf.str
+        if left != None and len(st) < minlen:
+            # Both neighbours were undersized, take one more leaf
+            leaf = Rope.last_leaf(left)
+            left, _ = Rope.split_node(left, left.length - leaf.length)
+            st = leaf.str + st
+        mid = Rope.build(st, 0, len(st), maxlen)
+        return Rope.join(Rope.join(left, mid), right)
+
+    @staticmethod
+    def join_merge(a, b, maxlen):
+        # Like join, but the last leaf of a and the first leaf of b are
+        # merged if either of them is undersized
+        if a == None:
+            return b
+        if b == None:
+            return a
+        minlen = maxlen // 2
+        la = Rope.last_leaf(a)
+        fb = Rope.first_leaf(b)
+        if la.length >= minlen and fb.length >= minlen:
+            return Rope.join(a, b)
+        a, _ = Rope.split_node(a, a.length - la.length)
+        _, b = Rope.split_node(b, fb.length)
+        st = la.str + fb.str
+        return Rope.join(Rope.join(a, Rope.build(st, 0, len(st), maxlen)), b)
 
     def concat(self, other):
-        if self.get_length() == 0:
-            # If current rope is empty, just make current rope
-            # the same as the other rope
-            Rope.copy(other, self)
-            return
-        # Create a new rope with left subrope as this rope and
-        # right subrope as the other rope
-        rp = Rope()
-        Rope.copy(self, rp)
-        self.left = rp
-        self.right = other
-        self.str = None
-        self.strlen = self.left.get_length()
+        # Append the rope other to the end of this rope
+        if other != None:
+            self.root = Rope.join(self.root, other.root)
 
     def split(self, idx):
         # Split at idx, stores indices 0 to idx-1 in this Rope itself
         # Return a Rope with indices idx to the end
-        if self.str != None:
-            # Base case, leaf node
-            # If split is within the node, remove excess portion, create a new Rope
-            # with what was removed and return the new Rope
-            if idx > self.strlen:
-                raise IndexError('Invalid index in split')
-            self.strlen = idx
-            ret = self.str[idx:]
-            self.str = self.str[0:idx]
-            return Rope.from_string(ret, maxlen=self.maxlen)
-        else:
-            if idx == self.strlen:
-                # If split is exactly between left and right child,
-                # return right child
-                other = self.right
-                self.right = None
-                return other
-            elif idx < self.strlen:
-                # if split starts in left subrope,
-                # Recursively call on left subrope, and concatenate
-                # right subrope
-                if self.left == None:
-                    raise IndexError('Invalid index in split')
-                other = Rope(maxlen=self.maxlen)
-                other.left = self.left.split(idx)
-                other.strlen = self.strlen - idx
-                other.right = self.right
-                self.right = None
-                return other
+        self.root, right = Rope.split_node(self.root, idx)
+        return Rope(self.maxlen, right)
+
+    def snapshot(self):
+        # Return a read-only view of the current contents in O(1), it is not
+        # affected by later edits to this rope
+        return RopeSnapshot(self.maxlen, self.root)
+
+    def byte_offset(self, idx):
+        # Return the offset in the UTF-8 encoded text of the char at index
+        # idx, which may be the length of the rope. O(log n) in UTF-8 mode
+        if idx < 0 or idx > self.get_length():
+            raise IndexError("Invalid index in byte_offset()")
+        if self.root == None:
+            return 0
+        node = self.root
+        offset = 0
+        while node.depth > 0:
+            if idx < node.left.length:
+                node = node.left
             else:
-                # If split starts completely in the right, 
-                # decrement index and call recursively on the right
-                # subrope
-                if self.right == None:
-                    raise IndexError('Invalid index in split')
-                other = self.right.split(idx - self.strlen)
-                return other
+                idx -= node.left.length
+                offset += node.left.nbytes
+                node = node.right
+        if node.nbytes == node.length:
+            return offset + idx
+        return offset + len(node.str[:idx].encode('utf-8', 'surrogatepass'))
+    def char_offset(self, offset):
+        # Return the index of the char at offset in the UTF-8 encoded text,
+        # inverse of byte_offset. Raises ValueError if offset is inside the
+        # encoding of a char
+        if self.root == None or offset == 0:
+            if offset != 0:
+                raise IndexError("Invalid offset in char_offset()")
+            return 0
+        if offset < 0 or offset > self.root.nbytes:
+            raise IndexError("Invalid offset in char_offset()")
+        node = self.root
+        idx = 0
+        while node.depth > 0:
+            if offset < node.left.nbytes:
+                node = node.left
+            else:
+                offset -= node.left.nbytes
+                idx += node.left.length
+                node = node.right
+        if node.nbytes == node.length:
+            return idx + offset
+        data = node.str.encode('utf-8', 'surrogatepass')
+        return idx + len(data[:offset].decode('utf-8', 'surrogatepass'))
+    def memory_usage(self):
+        # Return a tuple (nodes, leaves, bytes) for this rope, where bytes
+        # counts the node objects and the strings held by the leaves
+        if self.root == None:
+            return 0, 0, sys.getsizeof(self)
+        nodes = 0
+        leaves = 0
+        total = sys.getsizeof(self)
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            total += sys.getsizeof(node)
+            if node.depth == 0:
+                leaves += 1
+                if isinstance(node, Utf8RopeLeaf):
+                    # A memoryview of a mapping only counts as the view
+                    total += sys.getsizeof(node.data)
+                elif not isinstance(node, MappedRopeLeaf):
+                    # Mapped leaves hold no text, only the mapping
+                    total += sys.getsizeof(node.str)
+            else:
+                nodes += 1
+                stack.append(node.right)
+                stack.append(node.left)
+        return nodes, leaves, total
 
     def print_debug(self):
-        if self.str == None:
-            print(f'Internal node {self.id}')
-            print(f'strlen: {self.strlen}')
-            if self.left != None:
-                print(f'Left: {self.left.id}')
-            if self.right != None:
-                print(f'Right: {self.right.id}')
-            print('')
-
-            if self.left != None:
-                self.left.print_debug()
-            if self.right != None:
-                self.right.print_debug()
+        # Print every node of the rope, ids are only shown for nodes created
+        # while debug ids were enabled (see set_debug_ids)
+        if self.root == None:
+            print('Empty rope')
+            return
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            nid = getattr(node, 'id', '-')
+            if node.depth > 0:
+                print(f'Internal node {nid}')
+                print(f'strlen: {node.left.length}')
+                print(f'Left: {getattr(node.left, "id", "-")}')
+                print(f'Right: {getattr(node.right, "id", "-")}')
+                print('')
+                stack.append(node.right)
+                stack.append(node.left)
+            else:
+                print(f'External node {nid}')
+                print(f'str: {node.str} strlen: {node.length}')
+                print('')
+
+class RopeSnapshot(Rope):
+    # Read-only Rope, returned by Rope.snapshot and TextEditor.snapshot
+    __slots__ = ()
+    def read_only(self, *args):
+        raise TypeError("Rope snapshots are read-only")
+    insert_string = read_only
+    delete_chars = read_only
+    apply_edits = read_only
+    edit_leaf = read_only
+    rebalance = read_only
+    concat = read_only
+    split = read_only
+
+# Bits of the trigram filter kept for every node by SearchIndex, and chars
+# kept from both ends of every node for matches crossing its children
+INDEX_BITS = 4096
+INDEX_EDGE = 32
+
+class SearchIndex:
+    # Trigram index of a rope for search_string, see TextEditor.enable_index.
+    # Every node of the indexed version has an entry (node, mask, head,
+    # tail): mask is a bloom filter of the trigrams of its text, where a
+    # trigram sets bit hash(trigram) % bits, head and tail are the first and
+    # last INDEX_EDGE chars of its text. A search only descends into nodes
+    # whose mask has all the bits of the pattern's trigrams, and checks the
+    # text around the split of each visited internal node for matches that
+    # cross it, so selective patterns are found without reading most leaves.
+    # Nodes are immutable and shared between versions, so after edits only
+    # the nodes that are not in the indexed version get new entries, which
+    # are a few paths from the root and the leaves at the seams of the edits
+    # entries: id(node) -> entry, the node is kept so that its id stays unique
+    # root: indexed version
+    def __init__(self, bits=INDEX_BITS):
+        self.bits = bits
+        self.entries = {}
+        self.root = None
+    def sync(self, root):
+        # Index the version root, adding entries for its new nodes and
+        # removing the entries of the nodes only in the indexed version
+        if root is self.root:
+            return
+        # Nodes of root that were already indexed, their subtrees are shared
+        shared = set()
+        if root != None:
+            self.add(root, shared)
+        stack = [] if self.root == None else [self.root]
+        while stack:
+            node = stack.pop()
+            if id(node) in shared:
+                continue
+            if self.entries.pop(id(node), None) != None and node.depth > 0:
+                stack.append(node.left)
+                stack.append(node.right)
+        self.root = root
+    def add(self, node, shared):
+        # Return the entry of node, creating the entries of its subtree that
+        # are missing. The ids of the nodes found indexed are added to shared
+        entry = self.entries.get(id(node))
+        if entry != None:
+            shared.add(id(node))
+            return entry
+        if node.depth == 0:
+            st = node.str
+            mask = self.trigram_mask(st)
+            entry = (node, mask, st[:INDEX_EDGE], st[-INDEX_EDGE:])
+        else:
+            left = self.add(node.left, shared)
+            right = self.add(node.right, shared)
+            # Trigrams made of chars from both children
+            mask = left[1] | right[1] | self.trigram_mask(left[3][-2:] + right[2][:2])
+            head = left[2] if len(left[2]) == INDEX_EDGE else (left[2] + right[2])[:INDEX_EDGE]
+            tail = right[3] if len(right[3]) == INDEX_EDGE else (left[3] + right[3])[-INDEX_EDGE:]
+            entry = (node, mask, head, tail)
+        self.entries[id(node)] = entry
+        return entry
+    def trigram_mask(self, st):
+        # Return the bloom filter of the trigrams of st as an int
+        bits = self.bits
+        buf = bytearray(bits >> 3)
+        for tri in {st[i:i+3] for i in range(len(st) - 2)}:
+            h = hash(tri) % bits
+            buf[h >> 3] |= 1 << (h & 7)
+        return int.from_bytes(buf, 'little')
+    def find(self, root, sub):
+        # Return the list of starting indices of sub in the version root, sub
+        # must have at least 3 chars
+        self.sync(root)
+        found = []
+        if root != None:
+            self.collect(root, 0, sub, self.trigram_mask(sub), found)
+        return found
+    def collect(self, node, start, sub, query, found):
+        # Append to found the starting indices of the matches of sub inside
+        # the subtree node, which starts at index start, in increasing order
+        entries = self.entries
+        if entries[id(node)][1] & query != query:
+            return
+        if node.depth == 0:
+            st = node.str
+            pos = st.find(sub)
+            while pos != -1:
+                found.append(start + pos)
+                pos = st.find(sub, pos + 1)
+            return
+        self.collect(node.left, start, sub, query, found)
+        # Matches crossing the split start within the last len(sub)-1 chars
+        # of the left child and end in the first len(sub)-1 of the right one
+        split = start + node.left.length
+        keep = len(sub) - 1
+        if keep <= INDEX_EDGE:
+            before = entries[id(node.left)][3][-keep:]
+            text = before + entries[id(node.right)][2][:keep]
         else:
-            print(f'External node {self.id}')
-            print(f'str: {self.str} strlen: {self.strlen}')
-            print('')
+            lo = max(split - keep, start)
+            hi = min(split + keep, start + node.length)
+            text = RopeCursor(self.root, lo).read(hi - lo)
+            before = text[:split-lo]
+        pos = text.find(sub)
+        while pos != -1:
+            found.append(split - len(before) + pos)
+            pos = text.find(sub, pos + 1)
+        self.collect(node.right, split, sub, query, found)
+
+# Documents shorter than this are searched on the calling thread, below it
+# copying the text and dispatching the ranges costs more than the search
+PARALLEL_MIN_LENGTH = 1 << 22
+# Smallest range of text searched by one task
+PARALLEL_MIN_RANGE = 1 << 20
+
+def find_range(text, sub, count):
+    # Return the starting indices in text of the matches of sub that start
+    # in its first count chars, text holds len(sub)-1 more chars so that
+    # matches crossing the end of the range are found
+    found = []
+    pos = text.find(sub)
+    while pos != -1 and pos < count:
+        found.append(pos)
+        pos = text.find(sub, pos + 1)
+    return found
+
+# SharedMemory attached by a worker process, kept between tasks and closed
+# when the parent exports a new version
+worker_block = None
+
+def search_shared(name, encoding, width, start, count, end, sub):
+    # Task run by the worker processes of ParallelSearch: search the chars
+    # [start, end) of the text in the shared memory block name for matches
+    # of sub starting before start + count
+    global worker_block
+    if worker_block == None or worker_block.name != name:
+        if worker_block != None:
+            worker_block.close()
+        worker_block = shared_memory.SharedMemory(name=name)
+    text = bytes(worker_block.buf[start*width:end*width]).decode(encoding, 'surrogatepass')
+    return [start + pos for pos in find_range(text, sub, count)]
+
+def search_rope_range(rope, sub, start, count, end):
+    # Task run by the worker threads of ParallelSearch, threads share the
+    # rope so the range is read from it directly
+    text = rope.cursor(start).read(end - start)
+    return [start + pos for pos in find_range(text, sub, count)]
+
+class ParallelSearch:
+    # Searches a rope on a pool of workers, see TextEditor.enable_parallel_search.
+    # The text is split into contiguous ranges, each extended by len(sub)-1
+    # chars, searched by the workers and the sorted offsets are concatenated.
+    # With processes, the text of the searched version is copied once into
+    # shared memory, 1 byte per char if all chars are below 256 and else 4,
+    # and kept while the document does not change, so a task only sends the
+    # block name, its range and the pattern. The copy is serial and costs
+    # more than a serial search, so the first search of a version is serial
+    # and the version is only copied when it is searched again. Threads read
+    # the rope directly, str.find holds the GIL so they only scale on
+    # free-threaded builds
+    # root: rope version in the shared memory block
+    # seen: last version searched, copied if it is searched again
+    def __init__(self, workers=None, processes=True, min_length=PARALLEL_MIN_LENGTH):
+        self.workers = workers or os.cpu_count() or 1
+        self.processes = processes
+        self.min_length = min_length
+        self.executor = None
+        self.block = None
+        self.root = None
+        self.seen = None
+        self.encoding = None
+        self.width = 0
+    def search(self, rope, sub):
+        # Return the list of starting indices of sub in rope
+        length = rope.get_length()
+        if len(sub) == 0 or len(sub) > length:
+            return []
+        if self.processes and rope.root is not self.root:
+            if rope.root is not self.seen:
+                self.seen = rope.root
+                return list(rope.find_iter(sub))
+            self.export(rope)
+        if self.executor == None:
+            if self.processes:
+                self.executor = concurrent.futures.ProcessPoolExecutor(self.workers)
+            else:
+                self.executor = concurrent.futures.ThreadPoolExecutor(self.workers)
+        # A few ranges per worker so that a slow one does not hold the rest
+        size = max(-(-length // (self.workers * 4)), PARALLEL_MIN_RANGE)
+        keep = len(sub) - 1
+        futures = []
+        for start in range(0, length, size):
+            count = min(size, length - start)
+            end = min(start + count + keep, length)
+            if self.processes:
+                futures.append(self.executor.submit(search_shared, self.block.name, self.encoding,
+                                                    self.width, start, count, end, sub))
+            else:
+                futures.append(self.executor.submit(search_rope_range, rope, sub, start, count, end))
+        found = []
+        for future in futures:
+            found.extend(future.result())
+        return found
+    def export(self, rope):
+        # Copy the text of rope into a new shared memory block, one leaf at a
+        # time, replacing the previous block. Lone surrogates are kept, as in
+        # the rope, by encoding them with surrogatepass
+        self.release()
+        length = rope.get_length()
+        for encoding, width in (('latin-1', 1), ('utf-32-le', 4)):
+            block = shared_memory.SharedMemory(create=True, size=length * width)
+            pos = 0
+            try:
+                for chunk in Rope.iter_chunks(rope.root):
+                    data = chunk.encode(encoding, 'surrogatepass')
+                    block.buf[pos:pos+len(data)] = data
+                    pos += len(data)
+                break
+            except BaseException as e:
+                block.close()
+                block.unlink()
+                if width == 4 or not isinstance(e, UnicodeEncodeError):
+                    raise
+        self.block = block
+        self.root = rope.root
+        self.encoding = encoding
+        self.width = width
+    def release(self):
+        # Free the shared memory block
+        if self.block != None:
+            self.block.close()
+            self.block.unlink()
+        self.block = None
+        self.root = None
+        self.seen = None
+    def close(self):
+        # Stop the workers and free the shared memory block
+        if self.executor != None:
+            self.executor.shutdown()
+            self.executor = None
+        self.release()
 
 class TextEditor:
-    def __init__(self, rope=None):
+    def __init__(self, rope=None, maxlen=LEAF_SIZE, version_undo=False,
+                 coalesce=True, max_undo_ops=None, max_undo_size=None):
+        # maxlen: leaf size used when no rope is given
+        # version_undo: if True, every operation also keeps the rope versions
+        # before and after it, and undo/redo jump between them in O(1)
+        # instead of replaying the operation
+        # coalesce: if True, an insert right after the previous insert, or a
+        # delete next to the previous delete, extends that operation, up to
+        # maxlen chars, so typing a word is undone in one step
+        # max_undo_ops, max_undo_size: bound the undo history by number of
+        # operations and by chars held, dropping the oldest operations
         if rope == None:
-            rope = Rope(maxlen=5)
+            rope = Rope(maxlen=maxlen)
         self.rope = rope
-        self.undo_stack = OperationStack()
+        self.version_undo = version_undo
+        self.coalesce = coalesce
+        self.undo_stack = OperationStack(max_undo_ops, max_undo_size)
         self.redo_stack = OperationStack()
+        # ParallelSearch used by search_string, see enable_parallel_search
+        self.parallel = None
+        # SearchIndex used by search_string, see enable_index
+        self.index = None
+    @timed('edit')
     def insert_string(self, idx, st):
-        # Push the type of operation (INSERT) and params, idx and st into the undo stack)
-        self.undo_stack.push(Operation.INSERT, (idx, st))
+        before = self.rope.root
         # Insert the string st into index idx
         self.rope.insert_string(idx, st)
-        # Clear the redo stack, since redo is possible only immediately after a sequence of undos
-        self.redo_stack.clear()
-        pass
+        # Push the type of operation (INSERT) and params, idx and st into the undo stack)
+        self.record(Operation.INSERT, idx, st, before)
+    @timed('edit')
     def delete_chars(self, idx, n):
-        # Push the type of operation (DELETE) and params idx and the deleted substring into the undo stack
-        # The substring is pushed and not n since if undone, it must be reinserted
-        self.undo_stack.push(Operation.DELETE, (idx, self.rope.get_substring(idx, n)))
+        before = self.rope.root
+        # The deleted substring is pushed and not n since if undone, it must be reinserted
+        deleted = self.payload(idx, n)
         # Delete n chars starting from index idx
         self.rope.delete_chars(idx, n)
+        # Push the type of operation (DELETE) and params idx and the deleted substring into the undo stack
+        self.record(Operation.DELETE, idx, deleted, before)
+    def payload(self, idx, n):
+        # Return the n chars at idx for the undo stack. Up to maxlen chars
+        # are copied to a str, longer text is kept as a read-only Rope that
+        # shares the nodes of the current version
+        if n <= self.rope.maxlen:
+            return self.rope.get_substring(idx, n)
+        return self.rope.get_subrope(idx, n)
+    def record(self, tp, idx, st, before):
+        # Push an INSERT or DELETE operation for an edit that was just
+        # applied, merging it into the last operation when possible
+        # before: root of the rope before the edit
+        head = self.undo_stack.peek()
+        merged = None
+        if (self.coalesce and self.redo_stack.is_empty() and head != None and head.tp == tp
+                and isinstance(st, str) and isinstance(head.params[1], str)
+                and len(head.params[1]) + len(st) <= self.rope.maxlen):
+            hidx, hst = head.params
+            if tp == Operation.INSERT and idx == hidx + len(hst):
+                # Typing continues right after the last insert
+                merged = (hidx, hst + st)
+            elif tp == Operation.DELETE and idx + len(st) == hidx:
+                # Backspace right before the last delete
+                merged = (idx, st + hst)
+            elif tp == Operation.DELETE and idx == hidx:
+                # Forward delete at the same index as the last delete
+                merged = (hidx, hst + st)
+        if merged != None:
+            op = self.undo_stack.pop()
+            op.params = merged
+        else:
+            op = Operation(tp, (idx, st))
+            op.before = before if self.version_undo else None
+        op.after = self.rope.root if self.version_undo else None
+        self.undo_stack.push_op(op)
+        # Clear the redo stack, since redo is possible only immediately after a sequence of undos
+        self.redo_stack.clear()
+    @timed('edit')
+    def apply_edits(self, edits):
+        # Apply a list of edits (index, count, string) as a single operation,
+        # each replacing count chars at index with string. Indices refer to
+        # the document before the batch, inserts at the same index keep their
+        # order. Raises IndexError if an edit is out of bounds and ValueError
+        # if two edits overlap, without changing the document. An empty
+        # list does nothing and is not recorded
+        if not edits:
+            return
+        edits = sorted(edits, key=lambda edit: edit[0])
+        end = 0
+        batch = []
+        for idx, n, st in edits:
+            if idx < end:
+                raise ValueError("Overlapping edits in apply_edits()")
+            # payload checks the bounds
+            batch.append((idx, self.payload(idx, n), st))
+            end = idx + n
+        op = Operation(Operation.BATCH, batch)
+        op.before = self.rope.root if self.version_undo else None
+        self.rope.apply_edits(edits)
+        op.after = self.rope.root if self.version_undo else None
+        self.undo_stack.push_op(op)
         self.redo_stack.clear()
+    def replace_all(self, sub, st):
+        # Replace every non overlapping occurrence of sub with st as a single
+        # operation, returns the number of replacements
+        edits = []
+        end = 0
+        for idx in self.iter_search(sub):
+            if idx >= end:
+                edits.append((idx, len(sub), st))
+                end = idx + len(sub)
+        if edits:
+            self.apply_edits(edits)
+        return len(edits)
+    @staticmethod
+    def batch_edits(batch, undo):
+        # Return the edits for Rope.apply_edits that redo the BATCH params
+        # batch, or undo them if undo is True. Undoing puts back the deleted
+        # strings at the indices the inserted strings ended up at
+        if not undo:
+            return [(idx, len(deleted), st) for idx, deleted, st in batch]
+        edits = []
+        shift = 0
+        for idx, deleted, st in batch:
+            edits.append((idx + shift, len(st), deleted))
+            shift += len(st) - len(deleted)
+        return edits
+    @staticmethod
+    def open(path, maxlen=LEAF_SIZE, encoding='utf-8', **kwargs):
+        # Return a TextEditor on the file at path, see Rope.from_file
+        # kwargs are passed on to TextEditor
+        return TextEditor(Rope.from_file(path, maxlen, encoding), **kwargs)
+    def save(self, path, encoding='utf-8'):
+        # Write the document to path atomically, see Rope.save
+        self.rope.save(path, encoding)
+    def snapshot(self):
+        # Return a read-only view of the document in O(1), it stays valid
+        # and unchanged while editing continues
+        return self.rope.snapshot()
     def get_string(self):
         # Return the entire string stored in the editor
         return self.rope.get_string()
     def get_substring(self, idx, n):
         # Get the substring of n chars starting from index idx
         return self.rope.get_substring(idx, n)
+    def cursor(self, idx=0):
+        # Return a RopeCursor at index idx, it reads the version of the
+        # document current when it was created
+        return self.rope.cursor(idx)
+    @timed('undo')
     def undo(self):
         # Returns True if successfully undid the last operation
         # Returns False if no operation to undo
@@ -357,11 +1657,14 @@ class TextEditor:
         op = self.undo_stack.pop()
         if op == None:
             # No operation to undo
-            print("Popped none")
             return False
         # Push the current operation to redo stack
         # for performing redo later
         self.redo_stack.push_op(op)
+        if self.version_undo:
+            # Jump back to the version before the operation
+            self.rope.root = op.before
+            return True
         if op.tp == Operation.INSERT:
             # If last op was insert, delete the corresponding chars
             self.rope.delete_chars(op.params[0], len(op.params[1]))
@@ -370,6 +1673,10 @@ class TextEditor:
             # If last op was delete, reinsert the corresponding chars
             self.rope.insert_string(op.params[0], op.params[1])
             return True
+        elif op.tp == Operation.BATCH:
+            self.rope.apply_edits(TextEditor.batch_edits(op.params, True))
+            return True
+    @timed('undo')
     def redo(self):
         # Returns True if successfully complete
         # Returns False if no operation to redo
@@ -378,6 +1685,10 @@ class TextEditor:
             # No operations to redo
             return False
         self.undo_stack.push_op(op)
+        if self.version_undo:
+            # Jump forward to the version after the operation
+            self.rope.root = op.after
+            return True
         if op.tp == Operation.INSERT:
             # Insert the string that was removed by undo
             self.rope.insert_string(op.params[0], op.params[1])
@@ -386,146 +1697,579 @@ class TextEditor:
             # Delete the string that was reinserted by undo
             self.rope.delete_chars(op.params[0], len(op.params[1]))
             return True
+        elif op.tp == Operation.BATCH:
+            self.rope.apply_edits(TextEditor.batch_edits(op.params, False))
+            return True
         return False
     def length(self):
         return self.rope.get_length()
+    def line_count(self):
+        # Return the number of lines in the document
+        return self.rope.get_line_count()
+    def line_col(self, idx):
+        # Return (line, column) of index idx, both counting from 0
+        line = self.rope.newlines_before(idx)
+        return line, idx - self.rope.line_start(line)
+    def line_col_to_index(self, line, col):
+        # Return the index of column col of line, both counting from 0
+        # The column may point just past the end of the line
+        start = self.rope.line_start(line)
+        if col < 0 or col > self.line_end(line) - start:
+            raise IndexError("Invalid column in line_col_to_index()")
+        return start + col
+    def line_end(self, line):
+        # Return the index just past the last char of line, newline excluded
+        if line + 1 < self.line_count():
+            return self.rope.line_start(line + 1) - 1
+        self.rope.line_start(line) # Validates line
+        return self.length()
+    def get_line(self, line):
+        # Return the text of line (counting from 0) without its newline
+        start = self.rope.line_start(line)
+        return self.rope.get_substring(start, self.line_end(line) - start)
+    def enable_stats(self, callback=None):
+        # Turn on instrumentation, see RopeStats. The counters are process
+        # wide and start from zero. callback(event, seconds) is called after
+        # every timed event
+        Rope.set_stats(RopeStats(callback))
+    def disable_stats(self):
+        Rope.set_stats(None)
+    def stats(self):
+        # Return a dict with the shape of the rope: depth, leaf count,
+        # a histogram of leaf sizes (by power of 2 upper bound) and of leaf
+        # depths, plus the counters and timings if stats are enabled.
+        # The histograms walk the whole tree
+        sizes = {}
+        depths = {}
+        stack = [] if self.rope.root == None else [(self.rope.root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            if node.depth > 0:
+                stack.append((node.right, depth + 1))
+                stack.append((node.left, depth + 1))
+                continue
+            bound = 1 << (node.length - 1).bit_length()
+            sizes[bound] = sizes.get(bound, 0) + 1
+            depths[depth] = depths.get(depth, 0) + 1
+        result = {
+            'length': self.length(),
+            'depth': self.rope.get_depth(),
+            'leaves': self.rope.get_leaf_count(),
+            'leaf_sizes': dict(sorted(sizes.items())),
+            'leaf_depths': dict(sorted(depths.items())),
+        }
+        if Rope.stats != None:
+            result.update(Rope.stats.as_dict())
+        return result
+    def byte_offset(self, index):
+        # Offset of a char in the UTF-8 encoded document, see Rope.byte_offset
+        return self.rope.byte_offset(index)
+    def char_offset(self, offset):
+        # Index of the char at a UTF-8 offset, see Rope.char_offset
+        return self.rope.char_offset(offset)
+    def memory_report(self):
+        # Return a dict describing the memory held by the document,
+        # bytes_per_char is the figure to track across releases
+        nodes, leaves, total = self.rope.memory_usage()
+        chars = self.length()
+        return {
+            'chars': chars,
+            'nodes': nodes,
+            'leaves': leaves,
+            'bytes': total,
+            'bytes_per_char': total / chars if chars else 0.0,
+        }
+    @timed('search')
     def search_string(self, sub):
         # Return a list of starting indices where the string sub is present
         # in the current string stored by the TextEditor
+        if self.index != None and len(sub) >= 3:
+            return self.index.find(self.rope.root, sub)
+        if self.parallel != None and self.length() >= self.parallel.min_length:
+            return self.parallel.search(self.rope, sub)
+        return list(self.iter_search(sub))
+    def enable_parallel_search(self, workers=None, processes=True, min_length=PARALLEL_MIN_LENGTH):
+        # Make search_string split documents of at least min_length chars
+        # into ranges searched by a pool of workers (default: one per core),
+        # processes or threads, see ParallelSearch. The pool is started on
+        # the first parallel search. Processes search a copy of the text,
+        # made when a version is searched a second time, so searching right
+        # after every edit stays serial and only repeated searches of an
+        # unchanged document get faster
+        self.disable_parallel_search()
+        self.parallel = ParallelSearch(workers, processes, min_length)
+    def disable_parallel_search(self):
+        # Stop the workers and free the shared memory of parallel search
+        if self.parallel != None:
+            self.parallel.close()
+            self.parallel = None
+    def enable_index(self, bits=INDEX_BITS):
+        # Make search_string use a trigram index, see SearchIndex. It is
+        # built on the first search and brought up to date on the next ones,
+        # whatever the edits were, by indexing only the changed nodes.
+        # Patterns shorter than 3 chars still scan the document. The filters
+        # take bits/8 bytes for every node, leaf or internal, and with the
+        # entries and their head and tail strings the index is about 1.5
+        # times the size of ASCII text with the default leaf size
+        self.index = SearchIndex(bits)
+    def disable_index(self):
+        self.index = None
+    def iter_search(self, sub):
+        # Generator over the starting indices of sub in increasing order,
+        # see Rope.find_iter. The document is not materialized, and
+        # the search runs on the version current when this is called
+        return self.rope.find_iter(sub)
+    @timed('search')
+    def search_many(self, patterns):
+        # Return a dict mapping each pattern to the list of its starting
+        # indices, all patterns are found in a single pass over the rope
+        result = {pat: [] for pat in patterns}
+        for idx, pat in self.iter_search_many(patterns):
+            result[pat].append(idx)
+        return result
+    def iter_search_many(self, patterns):
+        # Generator over (index, pattern) for every occurrence of any of the
+        # patterns, in order of the end of the match
+        return self.rope.find_many_iter(patterns)
+    @timed('search')
+    def search_regex(self, pattern, max_match=LEAF_SIZE):
+        # Return a list of (index, matched string) for the non empty matches
+        # of the regex pattern, see Rope.find_regex_chunks for max_match
+        return list(self.iter_search_regex(pattern, max_match))
+    def iter_search_regex(self, pattern, max_match=LEAF_SIZE):
+        # Generator version of search_regex
+        return self.rope.find_regex_iter(pattern, max_match)
+ 
+def unescape(st):
+    # Decode the escapes \n, \t and \\ of an inline insert payload, other
+    # backslashes are kept
+    return re.sub(r'\\([nt\\])', lambda m: {'n': '\n', 't': '\t', '\\': '\\'}[m[1]], st)
 
-        # prime : prime number as modulus
-        # base : base that is size of English alphabet set = 26
-        # sub: substring to find, use self.rope.get_string
-        # st: string in which sub is to be found
-        # str_hash: stores hash value of current part of string 
-        # pat_hash: stores hash value of pattern
-        # pat_len: store length of pattern
-        # str_len: stores length of string
-        st = self.rope.get_string()
-        pat_len = len(sub)
-        str_len = len(st)
-        prime = 53
-        base = 26
-        str_hash = 0
-        pat_hash = 0
-
-        index_list = []
-
-        h = pow(base, pat_len - 1, prime) # Precompute base^(pat_len-1) % prime
-
-        if pat_len == 0:
-            return []
-        if pat_len > str_len:
-            return []
+def inline_payload(cmd_line):
+    # Return the string given after the index of an insert command, as in
+    # "i 5 some text", or None if there is none. One space separates it
+    # from the index, so it may start with spaces
+    m = re.match(r'\s*\S+\s+\S+ (.*)$', cmd_line, re.S)
+    return None if m == None else unescape(m[1])
 
-        # Calculate hash value of pattern and first window of text
-        for i in range(pat_len):
-            pat_hash = (base * pat_hash + ord(sub[i])) % prime
-            str_hash = (base * str_hash + ord(st[i])) % prime
-    
-        # Slide the pattern over text one by one
-        for i in range(str_len - pat_len + 1):
-            # Check the hash values of current window of text and pattern
-            # If the hash values match then only check for characters one by one
-            if pat_hash == str_hash:
-                match = True
-                for j in range(pat_len):
-                    if st[i+j] != sub[j]:
-                        match = False
-                        break
-                if match:
-                    index_list.append(i)
-            
-            # Calculate hash value for next window of text: Remove leading digit,
-            # add trailing digit
-            if i < str_len - pat_len:
-                # Remove leading character's hash contribution
-                str_hash = (str_hash - ord(st[i]) * h) % prime
-                # Add new character's hash contribution
-                str_hash = (base * str_hash + ord(st[i+pat_len])) % prime
-                # Ensure hash is non-negative
-                if str_hash < 0:
-                    str_hash += prime
-        return index_list
- 
-if __name__ == '__main__':
-    te = TextEditor()
+def run_command(te, cmd_line, out=print, prompt=input):
+    # Run one CLI command on te, writing output lines with out and reading
+    # the string of an insert without inline text with prompt. Returns the
+    # editor, which o replaces, and True if the command was ex
     done = False
-    while not done:
+    op = cmd_line.split()
+    if not op: # Handle empty input
+        return te, done
+    # Only the command is case insensitive, patterns are not
+    op[0] = op[0].lower()
+    if op[0] == 'i':
+        if len(op) > 1:
+            idx = int(op[1])
+            line = inline_payload(cmd_line)
+            if line == None:
+                line = prompt("Enter string to insert: ")
+            te.insert_string(idx, line)
+        else:
+            out("Usage: i [index]")
+    elif op[0] == 'p':
+        if len(op) == 1:
+            out(te.get_string())
+        elif len(op) == 3:
+            try:
+                out(te.get_substring(int(op[1]), int(op[2])))
+            except IndexError:
+                out("Error: Index out of bounds for substring.")
+            except ValueError:
+                out("Error: Invalid index or length for substring.")
+        else:
+            out("Usage: p OR p [index] [length]")
+    elif op[0] == 'd':
+        if len(op) == 3:
+            try:
+                # delete_chars in TextEditor currently doesn't return the deleted string,
+                # but the sample commands imply it prints something.
+                # For now, let's assume it should print a confirmation or the operation itself.
+                # The original code had `print(te.delete_chars(int(op[1]), int(op[2])))`
+                # which would print None. Let's make it more informative.
+                deleted_substring = te.get_substring(int(op[1]), int(op[2])) # Get before deleting for undo
+                te.delete_chars(int(op[1]), int(op[2]))
+                out(f"Deleted: '{deleted_substring}'")
+            except IndexError:
+                out("Error: Index out of bounds for delete.")
+            except ValueError:
+                out("Error: Invalid index or count for delete.")
+        else:
+            out("Usage: d [index] [length]")
+    elif op[0] == 'f':
+        if len(op) == 2:
+            out(te.search_string(op[1]))
+        elif len(op) > 2:
+            for pat, indices in te.search_many(op[1:]).items():
+                out(f"{pat}: {indices}")
+        else:
+            out("Usage: f [substring] [substring] ...")
+    elif op[0] == 'fr':
+        if len(op) > 1:
+            # The regex is the rest of the line, so it may contain spaces
+            try:
+                out(te.search_regex(cmd_line.split(None, 1)[1]))
+            except re.error as e:
+                out(f"Error: Invalid regex: {e}")
+        else:
+            out("Usage: fr [regex]")
+    elif op[0] == 'r':
+        if te.redo():
+            out("Redo successful")
+        else:
+            out("No operation to redo")
+    elif op[0] == "u":
+        if te.undo():
+            out("Undo successful")
+        else:
+            out("No operation to undo")
+    elif op[0] == "ex":
+        out("Exiting...")
+        done = True
+    elif op[0] == "l":
+        out(f'Length: {te.length()}')
+    elif op[0] == "o":
+        if len(op) > 1:
+            # The path is the rest of the line, so it may contain spaces
+            try:
+                te = TextEditor.open(cmd_line.split(None, 1)[1])
+                out(f'Opened, length: {te.length()}')
+            except (OSError, UnicodeDecodeError) as e:
+                out(f"Error: Could not open file: {e}")
+        else:
+            out("Usage: o [path]")
+    elif op[0] == "s":
+        if len(op) > 1:
+            try:
+                te.save(cmd_line.split(None, 1)[1])
+                out("Saved")
+            except OSError as e:
+                out(f"Error: Could not save file: {e}")
+        else:
+            out("Usage: s [path]")
+    elif op[0] == "stats":
+        if len(op) == 1:
+            for key, value in te.stats().items():
+                out(f'{key}: {value}')
+        elif op[1] == "on":
+            te.enable_stats()
+            out("Stats enabled")
+        elif op[1] == "off":
+            te.disable_stats()
+            out("Stats disabled")
+        else:
+            out("Usage: stats OR stats on OR stats off")
+    elif op[0] == "ix":
+        if len(op) == 2 and op[1] == "on":
+            te.enable_index()
+            out("Search index enabled")
+        elif len(op) == 2 and op[1] == "off":
+            te.disable_index()
+            out("Search index disabled")
+        else:
+            out("Usage: ix on OR ix off")
+    elif op[0] == "ll":
+        out(f'Lines: {te.line_count()}')
+    elif op[0] == "pl":
+        if len(op) == 2:
+            try:
+                out(te.get_line(int(op[1])))
+            except IndexError:
+                out("Error: Line out of bounds.")
+            except ValueError:
+                out("Error: Invalid line.")
+        else:
+            out("Usage: pl [line]")
+    elif op[0] == "lc":
+        if len(op) == 2:
+            try:
+                line, col = te.line_col(int(op[1]))
+                out(f'Line: {line} Column: {col}')
+            except IndexError:
+                out("Error: Index out of bounds.")
+            except ValueError:
+                out("Error: Invalid index.")
+        else:
+            out("Usage: lc [index]")
+    elif op[0] == "lo":
+        if len(op) == 3:
+            try:
+                out(f'Index: {te.line_col_to_index(int(op[1]), int(op[2]))}')
+            except IndexError:
+                out("Error: Line or column out of bounds.")
+            except ValueError:
+                out("Error: Invalid line or column.")
+        else:
+            out("Usage: lo [line] [column]")
+    elif op[0] == "h":
+        out("\nTextEditor Commands:")
+        out("  i [index]          - Insert string at index (prompts for string)")
+        out("  p                  - Print the entire string")
+        out("  p [index] [length] - Print substring")
+        out("  d [index] [length] - Delete characters")
+        out("  f [substring] ...  - Find all occurrences of one or more substrings")
+        out("  fr [regex]         - Find all matches of a regular expression")
+        out("  u                  - Undo last operation")
+        out("  r                  - Redo last undone operation")
+        out("  l                  - Print total length of the string")
+        out("  o [path]           - Open a file, replacing the current document")
+        out("  s [path]           - Save the document to a file")
+        out("  ll                 - Print the number of lines")
+        out("  pl [line]          - Print a line (lines and columns count from 0)")
+        out("  lc [index]         - Print line and column of an index")
+        out("  lo [line] [column] - Print the index of a line and column")
+        out("  stats [on|off]     - Print rope statistics, or turn instrumentation on or off")
+        out("  ix [on|off]        - Turn the search index used by f on or off")
+        out("  h                  - Display this help message")
+        out("  ex                 - Exit the editor\n")
+    else:
+        out(f"Unknown command: {op[0]}. Type 'h' for help.")
+    return te, done
+
+# Length of the string of an edit above which EditGroup applies its edits
+BATCH_MAX_TEXT = 1 << 16
+
+class EditGroup:
+    # Gathers consecutive edits to a TextEditor, given in the coordinates
+    # of the document after the previous ones, into a group of non
+    # overlapping edits in the coordinates of the document before the
+    # group, for TextEditor.apply_edits. An edit that touches the last one,
+    # or falls in its string, is merged into it, so typing or backspacing a
+    # word becomes a single edit. The group is applied when an edit overlaps
+    # it or by flush, as one undo step, unless record is True: then the
+    # edits are applied to the rope together but every add is recorded as
+    # its own operation, so undo and redo act as if each edit was made on
+    # the editor
+    # edits: [index, count, string, start] where start is the index of
+    # string in the current document
+    # shift: chars added by the group so far
+    # length: length of the document with the group applied
+    # ops: (type, index, string) operations to record, with record
+    # deleted: text removed by the last add, with record
+    def __init__(self, te, record=False):
+        self.te = te
+        self.edits = []
+        self.shift = 0
+        self.length = te.length()
+        self.record = record
+        self.ops = []
+        self.deleted = ""
+    def add(self, idx, n, st):
+        # Replace n chars at idx with st, returns False, changing nothing, if
+        # they are out of bounds. Raises TypeError, changing nothing, unless
+        # idx and n are ints and st a str
+        if type(idx) is not int or type(n) is not int or not isinstance(st, str):
+            raise TypeError("EditGroup.add() takes an int index and count and a str")
+        if idx < 0 or n < 0 or idx + n > self.length:
+            return False
+        if self.record and n > self.te.rope.maxlen:
+            # The editor keeps large deleted text as shared rope nodes
+            self.flush()
+            self.deleted = self.te.get_substring(idx, n)
+            self.te.delete_chars(idx, n)
+            if st:
+                self.te.insert_string(idx, st)
+            self.length += len(st) - n
+            return True
+        if self.record:
+            self.deleted = self.text(idx, n)
+        edits = self.edits
+        last = edits[-1] if edits else None
+        if last != None and len(last[2]) > BATCH_MAX_TEXT:
+            # Strings are copied when edited, keep them short
+            self.flush()
+            edits = self.edits
+            last = None
+        if last != None and last[3] <= idx and idx + n <= last[3] + len(last[2]):
+            # Inside the string of the last edit, such as a backspace over
+            # text just typed
+            pos = idx - last[3]
+            last[2] = last[2][:pos] + st + last[2][pos+n:]
+        elif last != None and idx == last[3] + len(last[2]):
+            # Continues right after the last edit
+            last[1] += n
+            last[2] += st
+        elif last != None and idx + n == last[3] and (len(edits) == 1 or idx >= edits[-2][3] + len(edits[-2][2])):
+            # Ends right before the last edit, such as a backspace
+            last[0] -= n
+            last[1] += n
+            last[2] = st + last[2]
+            last[3] = idx
+        elif last == None or idx > last[3] + len(last[2]):
+            edits.append([idx - self.shift, n, st, idx])
+        else:
+            self.flush()
+            self.edits.append([idx, n, st, idx])
+        self.shift += len(st) - n
+        self.length += len(st) - n
+        if self.record and n:
+            self.ops.append((Operation.DELETE, idx, self.deleted))
+        if self.record and st:
+            self.ops.append((Operation.INSERT, idx, st))
+        return True
+    def text(self, idx, n):
+        # Return the n chars at idx of the document with the group applied.
+        # The edits are visited from the last one back to idx, which is at
+        # most the last one for the edits add keeps
+        parts = []
+        end = idx + n
+        shift = self.shift
+        for _, count, st, start in reversed(self.edits):
+            # Text of the document before the group, after this edit
+            low = max(start + len(st), idx)
+            if low < end:
+                parts.append(self.te.get_substring(low - shift, end - low))
+                end = low
+            if end <= idx:
+                break
+            low = max(start, idx)
+            if low < end:
+                parts.append(st[low-start:end-start])
+                end = low
+            shift -= len(st) - count
+        if end > idx:
+            parts.append(self.te.get_substring(idx - shift, end - idx))
+        return "".join(reversed(parts))
+    def flush(self):
+        # Apply the edits of the group to the editor. If that fails the group
+        # is dropped and length is taken from the editor again
+        edits = [(idx, n, st) for idx, n, st, _ in self.edits if n or st]
+        ops = self.ops
+        self.edits = []
+        self.ops = []
+        self.shift = 0
         try:
-            op = input().lower().split()
-            if not op: # Handle empty input
-                continue
-            if op[0] == 'i':
-                if len(op) > 1:
-                    idx = int(op[1])
-                    line = input("Enter string to insert: ")
-                    te.insert_string(idx, line)
-                else:
-                    print("Usage: i [index]")
-            elif op[0] == 'p':
-                if len(op) == 1:
-                    print(te.get_string())
-                elif len(op) == 3:
-                    try:
-                        print(te.get_substring(int(op[1]), int(op[2])))
-                    except IndexError:
-                        print("Error: Index out of bounds for substring.")
-                    except ValueError:
-                        print("Error: Invalid index or length for substring.")
-                else:
-                    print("Usage: p OR p [index] [length]")
-            elif op[0] == 'd':
-                if len(op) == 3:
-                    try:
-                        # delete_chars in TextEditor currently doesn't return the deleted string,
-                        # but the sample commands imply it prints something.
-                        # For now, let's assume it should print a confirmation or the operation itself.
-                        # The original code had `print(te.delete_chars(int(op[1]), int(op[2])))`
-                        # which would print None. Let's make it more informative.
-                        deleted_substring = te.get_substring(int(op[1]), int(op[2])) # Get before deleting for undo
-                        te.delete_chars(int(op[1]), int(op[2]))
-                        print(f"Deleted: '{deleted_substring}'")
-                    except IndexError:
-                        print("Error: Index out of bounds for delete.")
-                    except ValueError:
-                        print("Error: Invalid index or count for delete.")
-                else:
-                    print("Usage: d [index] [length]")
-            elif op[0] == 'f':
-                if len(op) > 1:
-                    print(te.search_string(op[1]))
-                else:
-                    print("Usage: f [substring]")
-            elif op[0] == 'r':
-                if te.redo():
-                    print("Redo successful")
+            self.apply(edits, ops)
+        except BaseException:
+            self.length = self.te.length()
+            raise
+    def apply(self, edits, ops):
+        te = self.te
+        if ops and te.version_undo:
+            # Every operation needs the versions before and after it
+            for tp, idx, st in ops:
+                if tp == Operation.INSERT:
+                    te.insert_string(idx, st)
                 else:
-                    print("No operation to redo")
-            elif op[0] == "u":
-                if te.undo():
-                    print("Undo successful")
-                else:
-                    print("No operation to undo")
-            elif op[0] == "ex":
-                print("Exiting...")
+                    te.delete_chars(idx, len(st))
+            return
+        # Recorded operations are pushed after editing the rope directly
+        target = te.rope if ops else te
+        if len(edits) == 1 and edits[0][1] == 0:
+            target.insert_string(edits[0][0], edits[0][2])
+        elif len(edits) == 1 and edits[0][2] == "":
+            target.delete_chars(edits[0][0], edits[0][1])
+        elif edits:
+            target.apply_edits(edits)
+        for tp, idx, st in ops:
+            te.record(tp, idx, st, None)
+
+class BatchRunner:
+    # Runs a script of CLI commands without prompts, for headless use:
+    #   python rope_editor.py --batch script.txt   (or commands on stdin)
+    # Inserts take their text inline, as in "i 5 some text" with \n and \t
+    # escapes, or on the next line. Consecutive edits are gathered in an
+    # EditGroup, applied when another command needs the document, and each
+    # of them is still its own undo step, so a recorded session undoes and
+    # prints the same as in the editor. The output is kept and written once
+    # at the end
+    def __init__(self, te=None):
+        self.te = TextEditor() if te == None else te
+        self.group = EditGroup(self.te, True)
+        self.output = []
+        self.commands = 0
+    def run(self, lines):
+        # Run the commands in the list lines, stops at ex
+        lines = iter(lines)
+        prompt = lambda message: next(lines)
+        for cmd_line in lines:
+            self.commands += 1
+            op = cmd_line.split(None, 3)
+            if op and op[0].lower() in ('i', 'd') and self.edit(op, cmd_line, prompt):
+                continue
+            self.group.flush()
+            try:
+                self.te, done = run_command(self.te, cmd_line, self.write, prompt)
+            except StopIteration:
+                self.output.append("Error: Missing string to insert")
                 done = True
-            elif op[0] == "l":
-                print(f'Length: {te.length()}')
-            elif op[0] == "h":
-                print("\nTextEditor Commands:")
-                print("  i [index]          - Insert string at index (prompts for string)")
-                print("  p                  - Print the entire string")
-                print("  p [index] [length] - Print substring")
-                print("  d [index] [length] - Delete characters")
-                print("  f [substring]      - Find all occurrences of substring")
-                print("  u                  - Undo last operation")
-                print("  r                  - Redo last undone operation")
-                print("  l                  - Print total length of the string")
-                print("  h                  - Display this help message")
-                print("  ex                 - Exit the editor\n")
+            except Exception as e:
+                self.output.append(f"An error occurred: {e}")
+                done = False
+            # The command may have edited or replaced the document
+            self.group = EditGroup(self.te, True)
+            if done:
+                break
+        self.group.flush()
+    def write(self, value):
+        # Output function for run_command, keeps what print would write
+        self.output.append(str(value))
+    def edit(self, op, cmd_line, prompt):
+        # Add the insert or delete command op to the group, returns False if
+        # it is not valid, to let run_command report it
+        try:
+            idx = int(op[1])
+            if op[0].lower() == 'i':
+                n = 0
+                st = inline_payload(cmd_line)
+                if st == None:
+                    st = prompt("")
+            elif len(op) == 3:
+                n = int(op[2])
+                st = ""
             else:
-                print(f"Unknown command: {op[0]}. Type 'h' for help.")
+                return False
+        except (IndexError, ValueError):
+            return False
+        except StopIteration:
+            # The script ended before the string, as in run
+            self.group.flush()
+            self.output.append("Error: Missing string to insert")
+            return True
+        # An edit of nothing is not grouped, the editor still records it
+        if (n or st) and self.group.add(idx, n, st):
+            if n:
+                self.output.append(f"Deleted: '{self.group.deleted}'")
+            return True
+        if op[0].lower() == 'i':
+            # The string is already read, let the editor insert it or report
+            # its error
+            self.group.flush()
+            try:
+                self.te.insert_string(idx, st)
+            except Exception as e:
+                self.output.append(f"An error occurred: {e}")
+            return True
+        return False
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--batch':
+        if len(sys.argv) > 2:
+            with open(sys.argv[2], encoding='utf-8') as f:
+                script = f.read()
+        else:
+            script = sys.stdin.read()
+        lines = script.split('\n')
+        if lines[-1] == "":
+            lines.pop()
+        runner = BatchRunner()
+        start = time.perf_counter()
+        runner.run(lines)
+        elapsed = time.perf_counter() - start
+        if runner.output:
+            sys.stdout.write("\n".join(runner.output) + "\n")
+        print(f"{runner.commands} commands in {elapsed:.3f} s, "
+              f"{runner.commands / max(elapsed, 1e-9):.0f} commands/s", file=sys.stderr)
+        sys.exit(0)
+    te = TextEditor()
+    done = False
+    while not done:
+        try:
+            te, done = run_command(te, input())
         except EOFError:
             print("\nExiting due to EOF (Ctrl+D).")
             done = True
@@ -0,0 +1,176 @@
+import argparse
+import asyncio
+import json
+import sys
+
+from rope_editor import TextEditor, EditGroup, Rope, LEAF_SIZE
+
+# Asyncio server editing one TextEditor shared by many clients, over
+# localhost TCP or a Unix socket:
+#   python rope_server.py --port 8765
+#   python rope_server.py --unix /tmp/rope.sock --open notes.txt
+# Requests and responses are JSON objects, one per line. Every request has
+# an id, copied into its response with either result or error:
+#   {"id": 1, "op": "insert", "index": 0, "text": "hello"}
+#   {"id": 2, "op": "delete", "index": 0, "count": 2}
+#   {"id": 3, "op": "get", "index": 0, "count": 3}    -> {"id": 3, "result": "llo"}
+#   {"id": 4, "op": "search", "pattern": "l"}         -> {"id": 4, "result": [0, 1]}
+#   {"id": 5, "op": "undo"} / {"id": 6, "op": "redo"} -> {"id": 5, "result": true}
+#   {"id": 7, "op": "length"}
+# Clients may pipeline requests, responses come back in order. All the
+# requests a connection has sent are read at once, consecutive inserts and
+# deletes among them are gathered in an EditGroup and applied together, as
+# one undo step, before any other request or the end of the burst. The
+# group is always applied before the server waits for anything, so other
+# connections never see it half done. get and search read a snapshot of
+# the document taken once the edits before them are applied, and large
+# reads and searches run on a worker thread, so edits from other
+# connections go on while they run. Undo and redo act on the shared history
+
+# Reads of more chars than this run on a worker thread
+THREAD_READ = 1 << 16
+# Bytes read from a connection at a time
+READ_SIZE = 1 << 16
+
+def check_int(req, field):
+    # Raise TypeError unless req[field] is an int, JSON booleans and
+    # floats are not accepted as indices
+    if type(req[field]) is not int:
+        raise TypeError(f"{field} must be an integer")
+
+class EditServer:
+    # group: edits received but not applied yet, empty between bursts
+    def __init__(self, te):
+        self.te = te
+        self.group = EditGroup(te)
+        self.requests = 0
+    async def handle(self, reader, writer):
+        # Serve one connection until it is closed
+        loop = asyncio.get_running_loop()
+        buf = b""
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                lines = (buf + data).split(b"\n")
+                # The last line is incomplete, or empty
+                buf = lines.pop()
+                out = []
+                for line in lines:
+                    if not line.strip():
+                        continue
+                    rid, result, error = self.execute(line)
+                    if callable(result):
+                        # Runs on a snapshot, the group was applied
+                        try:
+                            result = await loop.run_in_executor(None, result)
+                        except Exception as e:
+                            result, error = None, str(e)
+                    out.append(self.response(rid, result, error))
+                self.flush()
+                writer.write(b"".join(out))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.flush()
+            writer.close()
+    def flush(self):
+        # Apply the group of edits. The edits were checked when they were
+        # added, so this only fails on a bug, which must not take the
+        # connection down
+        try:
+            self.group.flush()
+        except Exception as e:
+            print(f"Failed to apply edits: {e!r}", file=sys.stderr)
+    def execute(self, line):
+        # Run the request in line, returns (id, result, error). result may be
+        # a function to run on a worker thread that returns the result
+        self.requests += 1
+        rid = None
+        try:
+            req = json.loads(line)
+            rid = req.get('id')
+            op = req['op']
+            if op == 'insert':
+                check_int(req, 'index')
+                if not isinstance(req['text'], str):
+                    raise TypeError("text must be a string")
+                if not self.group.add(req['index'], 0, req['text']):
+                    raise IndexError("Invalid index in insert")
+                return rid, None, None
+            if op == 'delete':
+                check_int(req, 'index')
+                check_int(req, 'count')
+                if not self.group.add(req['index'], req['count'], ""):
+                    raise IndexError("Invalid index or count in delete")
+                return rid, None, None
+            if op == 'length':
+                return rid, self.group.length, None
+            self.group.flush()
+            if op == 'get':
+                check_int(req, 'index')
+                check_int(req, 'count')
+                snapshot = self.te.snapshot()
+                idx, n = req['index'], req['count']
+                if n > THREAD_READ:
+                    return rid, lambda: snapshot.get_substring(idx, n), None
+                return rid, snapshot.get_substring(idx, n), None
+            if op == 'search':
+                snapshot = self.te.snapshot()
+                pattern = req['pattern']
+                if not isinstance(pattern, str):
+                    raise TypeError("pattern must be a string")
+                return rid, lambda: list(snapshot.find_iter(pattern)), None
+            if op == 'undo':
+                result = self.te.undo()
+            elif op == 'redo':
+                result = self.te.redo()
+            else:
+                raise ValueError(f"Unknown op: {op}")
+            # The history may have changed the length
+            self.group = EditGroup(self.te)
+            return rid, result, None
+        except KeyError as e:
+            return rid, None, f"Missing field: {e}"
+        except Exception as e:
+            # Any failure only answers this request, such as a RecursionError
+            # from a deeply nested line, the others of the burst are answered
+            return rid, None, str(e) or type(e).__name__
+    @staticmethod
+    def response(rid, result, error):
+        if error != None:
+            return (json.dumps({'id': rid, 'error': error}) + "\n").encode()
+        return (json.dumps({'id': rid, 'result': result}) + "\n").encode()
+
+async def serve(server, host, port, unix):
+    # Serve until cancelled, prints the address once listening
+    if unix != None:
+        listener = await asyncio.start_unix_server(server.handle, unix)
+        print(f"Serving on {unix}", flush=True)
+    else:
+        listener = await asyncio.start_server(server.handle, host, port)
+        host, port = listener.sockets[0].getsockname()[:2]
+        print(f"Serving on {host}:{port}", flush=True)
+    async with listener:
+        await listener.serve_forever()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Asyncio editing server for the rope text editor")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on")
+    parser.add_argument('--port', type=int, default=8765, help="TCP port, 0 picks a free one")
+    parser.add_argument('--unix', help="listen on this Unix socket instead of TCP")
+    parser.add_argument('--open', help="file to edit, the document starts empty otherwise")
+    parser.add_argument('--maxlen', type=int, default=LEAF_SIZE, help="leaf size")
+    args = parser.parse_args()
+
+    if args.open:
+        te = TextEditor.open(args.open, args.maxlen)
+    else:
+        te = TextEditor(Rope(args.maxlen))
+    server = EditServer(te)
+    try:
+        asyncio.run(serve(server, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        print(f"Served {server.requests} requests", file=sys.stderr)
@@ -0,0 +1,411 @@
+import random
+import re
+
+import rope_editor
+from rope_editor import TextEditor, Rope, EditGroup, BatchRunner, run_command
+
+# Run with: python -m pytest -q
+
+def regex_matches(pattern, text):
+    # The non empty matches of re over the whole text, as search_regex returns them
+    return [(m.start(), m.group()) for m in re.finditer(pattern, text) if m.end() > m.start()]
+
+class CountingPattern:
+    # Compiled regex that counts the text each finditer call is given
+    def __init__(self, pattern):
+        self.pattern = re.compile(pattern)
+        self.longest = 0
+        self.scanned = 0
+    def finditer(self, text, pos):
+        self.longest = max(self.longest, len(text))
+        self.scanned += len(text) - pos
+        return self.pattern.finditer(text, pos)
+
+def test_search_regex_without_matches_is_linear():
+    # The window must not grow when nothing matches, and every char is
+    # scanned a bounded number of times
+    for size in (200_000, 800_000):
+        rope = Rope.from_string("ab c\n" * (size // 5))
+        pattern = CountingPattern('zq+')
+        assert list(Rope.find_regex_chunks(Rope.iter_chunks(rope.root), pattern, 1024)) == []
+        assert pattern.longest <= 3 * 1024 + rope.maxlen
+        assert pattern.scanned <= 3 * size
+
+def test_search_regex_assertions_across_leaves():
+    text = 'foo' * 2000
+    te = TextEditor(Rope.from_string(text, maxlen=7))
+    assert te.search_regex(r'\bfoo') == [(0, 'foo')]
+    assert te.search_regex(r'^a') == []
+    text = "ab ba\nab" * 300
+    te = TextEditor(Rope.from_string(text, maxlen=3))
+    for pattern in [r'^a', r'(?m)^a', r'\ba', r'a\b', r'(?<=b)a', r'\Bb', r'b$']:
+        assert te.search_regex(pattern, max_match=8) == regex_matches(pattern, text)
+
+def test_edit_group_rejects_bad_types_without_changes():
+    te = TextEditor()
+    group = EditGroup(te)
+    assert group.add(0, 0, "hello")
+    for args in [(2.5, 0, "x"), (0, 0, None), (0, 0, 3), (1, "1", "")]:
+        try:
+            group.add(*args)
+            assert False, args
+        except TypeError:
+            pass
+    assert group.length == 5
+    group.flush()
+    assert te.get_string() == "hello" and group.length == 5
+
+def test_batch_insert_missing_string_at_end():
+    runner = BatchRunner()
+    runner.run(["i 0 hello", "p", "i 3"])
+    assert runner.output == ["hello", "Error: Missing string to insert"]
+    assert runner.te.get_string() == "hello"
+
+def test_utf8_cursor_reads_each_leaf_once(monkeypatch):
+    decodes = []
+    text_of = rope_editor.Utf8RopeLeaf.str
+    monkeypatch.setattr(rope_editor.Utf8RopeLeaf, 'str', property(lambda leaf: decodes.append(leaf) or text_of.fget(leaf)))
+    Rope.set_utf8(True)
+    try:
+        text = "abcé\n" * 20000
+        te = TextEditor(Rope.from_string(text))
+        leaves = te.rope.root.leaves
+        assert "".join(te.cursor(0)) == text
+        assert len(decodes) == leaves
+        decodes.clear()
+        assert te.line_col_to_index(15000, 0) == 15000 * 5
+        # line_start and line_end, each decoding the leaf of its line
+        assert len(decodes) <= 3
+    finally:
+        Rope.set_utf8(False)
+
+def test_reading_a_mapped_file_does_not_keep_its_text(tmp_path):
+    path = tmp_path / "log.txt"
+    path.write_text("some log line here\n" * 50_000)
+    te = TextEditor.open(str(path))
+    before = te.memory_report()['bytes']
+    assert te.search_string('zzz') == []
+    assert len(te.get_string()) == 19 * 50_000
+    assert te.memory_report()['bytes'] == before
+
+def test_snapshots_reject_apply_edits_and_empty_batches_are_not_recorded():
+    te = TextEditor(Rope.from_string("hello"))
+    snapshot = te.snapshot()
+    for edit in (lambda: snapshot.apply_edits([(0, 1, 'J')]), lambda: snapshot.insert_string(0, 'J')):
+        try:
+            edit()
+            assert False
+        except TypeError:
+            pass
+    assert snapshot.get_string() == "hello"
+    te.insert_string(5, "!")
+    te.undo()
+    te.apply_edits([])
+    assert te.redo() and te.get_string() == "hello!"
+    te.undo()
+    assert te.undo() == False
+
+def test_deleting_a_single_leaf_document_leaves_no_root():
+    te = TextEditor(Rope.from_string("hello"))
+    te.insert_string(5, "!")
+    te.delete_chars(0, 6)
+    assert te.rope.root == None and te.get_string() == ""
+    te.insert_string(0, "x")
+    assert te.get_string() == "x"
+
+def run_interactive(lines):
+    # Run lines as the interactive editor does, returns (output, document)
+    te = TextEditor()
+    output = []
+    lines = iter(lines)
+    for cmd_line in lines:
+        try:
+            te, done = run_command(te, cmd_line, lambda value: output.append(str(value)), lambda message: next(lines))
+        except Exception as e:
+            output.append(f"An error occurred: {e}")
+            done = False
+        if done:
+            break
+    return output, te.get_string()
+
+def run_batch(lines):
+    runner = BatchRunner()
+    runner.run(lines)
+    return runner.output, runner.te.get_string()
+
+def test_batch_replays_sessions_like_the_editor():
+    scripts = [
+        ["i 0 abc", "d 0 1", "u", "p"],
+        ["i 0 hello world", "d 0 6", "i 3 X", "u", "u", "p"],
+        ["i 0", "two lines", "i 3 x", "d 2 0", "i 9 ", "u", "r", "r", "d 1 99", "i 99 y", "p"],
+    ]
+    rnd = random.Random(20)
+    for _ in range(200):
+        script = ["i 0 " + "abcdefgh" * rnd.randint(0, 300)]
+        length = len(script[0]) - 4
+        for _ in range(rnd.randint(1, 30)):
+            r = rnd.random()
+            if r < 0.4:
+                script.append(f"i {rnd.randint(0, length + 1)} " + rnd.choice(["x", "yz", "a\\nb"]))
+            elif r < 0.7:
+                script.append(f"d {rnd.randint(0, length)} {rnd.choice([0, 1, 2, 5, 1500])}")
+            elif r < 0.8:
+                script.append("u")
+            elif r < 0.9:
+                script.append("r")
+            else:
+                script.append(rnd.choice(["p", "l", "f ab", "p 2 3"]))
+        scripts.append(script + ["p"])
+    for script in scripts:
+        assert run_batch(script) == run_interactive(script), script
+
+def test_parallel_search_matches_serial_search(monkeypatch):
+    # Ranges of a few hundred chars, so that matches cross them
+    monkeypatch.setattr(rope_editor, 'PARALLEL_MIN_RANGE', 300)
+    rnd = random.Random(16)
+    texts = ["".join(rnd.choice("ab\n") for _ in range(5000)),
+             "".join(rnd.choice("abé€") for _ in range(5000)),
+             # Lone surrogates are kept by the rope
+             "ab\ud800" * 2000]
+    for processes in (True, False):
+        te = TextEditor()
+        te.enable_parallel_search(workers=3, processes=processes, min_length=1000)
+        try:
+            for text in texts:
+                te.rope = Rope.from_string(text, maxlen=64)
+                for _ in range(2):
+                    # The first search of a version is serial, the next ones
+                    # use the shared copy
+                    for sub in ["a", "ab", "ba", "aab\n", "bb", "\ud800a", "€a"]:
+                        expected = [m.start() for m in re.finditer(f"(?={re.escape(sub)})", text)]
+                        assert te.search_string(sub) == expected
+                    te.insert_string(0, "b")
+                    text = "b" + text
+        finally:
+            te.disable_parallel_search()
+        assert te.parallel == None
+
+def test_server_answers_every_pipelined_request():
+    # A real connection to an EditServer on a free port
+    import asyncio
+    import json
+    from rope_server import EditServer
+
+    async def session():
+        server = EditServer(TextEditor())
+        listener = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+        host, port = listener.sockets[0].getsockname()[:2]
+        reader, writer = await asyncio.open_connection(host, port)
+        requests = [
+            {'id': 1, 'op': 'insert', 'index': 0, 'text': "hello"},
+            {'id': 2, 'op': 'insert', 'index': 5, 'text': " world"},
+            '[' * 100000,
+            {'id': 4, 'op': 'delete', 'index': 0, 'count': True},
+            {'id': 5, 'op': 'get', 'index': 0, 'count': 5},
+            {'id': 6, 'op': 'delete', 'index': 5, 'count': 6},
+            {'id': 7, 'op': 'search', 'pattern': "l"},
+            {'id': 8, 'op': 'undo'},
+            {'id': 9, 'op': 'length'},
+            {'id': [[[0]]], 'op': 'nope'},
+        ]
+        writer.write(b"".join((r if isinstance(r, str) else json.dumps(r)).encode() + b"\n" for r in requests))
+        await writer.drain()
+        responses = [json.loads(await reader.readline()) for _ in requests]
+        writer.close()
+        await writer.wait_closed()
+        listener.close()
+        await listener.wait_closed()
+        return responses, server.te.get_string()
+
+    responses, text = asyncio.run(session())
+    assert [r['id'] for r in responses] == [1, 2, None, 4, 5, 6, 7, 8, 9, [[[0]]]]
+    assert [r.get('result') for r in responses[:2]] == [None, None]
+    assert 'error' in responses[2] and 'error' in responses[3] and 'error' in responses[9]
+    assert responses[4]['result'] == "hello"
+    assert responses[6]['result'] == [2, 3]
+    assert responses[7]['result'] == True and responses[8]['result'] == 11
+    assert text == "hello world"
+
+def test_utf8_edits_do_not_walk_older_nodes(monkeypatch):
+    # A document built before UTF-8 mode keeps its RopeNodes, whose size
+    # takes a walk of the subtree
+    te = TextEditor(Rope.from_string("abcé\n" * 20000, maxlen=64))
+    walks = []
+    nbytes = rope_editor.RopeNode.nbytes
+    monkeypatch.setattr(rope_editor.RopeNode, 'nbytes', property(lambda node: walks.append(node) or nbytes.fget(node)))
+    Rope.set_utf8(True)
+    try:
+        for i in range(100):
+            te.insert_string(i * 997, "€x")
+            te.delete_chars(i * 991, 3)
+        assert walks == []
+        text = te.get_string()
+        for idx in range(0, len(text), 3331):
+            offset = len(text[:idx].encode('utf-8'))
+            assert te.rope.byte_offset(idx) == offset and te.rope.char_offset(offset) == idx
+        assert te.rope.root.nbytes == len(text.encode('utf-8'))
+    finally:
+        Rope.set_utf8(False)
+
+def check_node(node, maxlen):
+    # Check the AVL balance and the cached fields of every node of the
+    # subtree node, returns its text
+    if node.depth == 0:
+        text = node.str
+        assert 0 < len(text) <= maxlen
+        assert node.length == len(text) and node.lines == text.count('\n') and node.leaves == 1
+        return text
+    assert abs(node.left.depth - node.right.depth) <= 1
+    assert node.depth == max(node.left.depth, node.right.depth) + 1
+    text = check_node(node.left, maxlen) + check_node(node.right, maxlen)
+    assert node.length == len(text) and node.lines == text.count('\n')
+    assert node.leaves == node.left.leaves + node.right.leaves
+    return text
+
+def check_rope(rope, text):
+    if rope.root == None:
+        assert text == ""
+    else:
+        assert check_node(rope.root, rope.maxlen) == text
+
+def check_document(te, text, rnd):
+    # Compare the searches and the line functions of te with the str text
+    check_rope(te.rope, text)
+    assert te.get_string() == text and te.length() == len(text)
+    for sub in ["a", "ab", "a\nb", "bab", "abab", rnd.choice(["aaaa", "b\n", "xyz"])]:
+        expected = [m.start() for m in re.finditer(f"(?={re.escape(sub)})", text)]
+        assert te.search_string(sub) == expected
+        assert list(te.iter_search(sub)) == expected
+    patterns = ["ab", "b", "aab", "\na"]
+    assert te.search_many(patterns) == {pat: [m.start() for m in re.finditer(f"(?={re.escape(pat)})", text)] for pat in patterns}
+    for pattern in ["a+b", r"^b", r"\bab", "(?m)a$"]:
+        assert te.search_regex(pattern) == regex_matches(pattern, text)
+    lines = text.split('\n')
+    assert te.line_count() == len(lines)
+    for line in {0, len(lines) - 1, rnd.randrange(len(lines))}:
+        assert te.get_line(line) == lines[line]
+    idx = rnd.randint(0, len(text))
+    line = text.count('\n', 0, idx)
+    col = idx - (text.rfind('\n', 0, idx) + 1)
+    assert te.line_col(idx) == (line, col)
+    assert te.line_col_to_index(line, col) == idx
+
+def random_string(rnd, maxlen):
+    size = rnd.choice([1, 2, 5, maxlen, 3 * maxlen + 1])
+    return "".join(rnd.choice("aab\n") for _ in range(size))
+
+def test_random_edits_keep_the_rope_balanced_and_match_a_str():
+    rnd = random.Random(1)
+    for maxlen, version_undo, index in [(4, False, False), (16, True, False), (16, False, True), (64, False, False)]:
+        te = TextEditor(Rope(maxlen), version_undo=version_undo, coalesce=False)
+        if index:
+            te.enable_index(256)
+        text = ""
+        undo, redo = [], []
+        for step in range(400):
+            r = rnd.random()
+            before = text
+            if r < 0.35:
+                idx = rnd.randint(0, len(text))
+                st = random_string(rnd, maxlen)
+                te.insert_string(idx, st)
+                text = text[:idx] + st + text[idx:]
+            elif r < 0.6 and text:
+                # Deletes of no chars are recorded as well
+                idx = rnd.randrange(len(text))
+                n = rnd.randint(0, min(len(text) - idx, rnd.choice([1, 3, maxlen, 10 * maxlen])))
+                te.delete_chars(idx, n)
+                text = text[:idx] + text[idx+n:]
+            elif r < 0.7:
+                edits = []
+                end = 0
+                while end <= len(text) and rnd.random() < 0.8:
+                    idx = rnd.randint(end, min(len(text), end + 2 * maxlen))
+                    n = rnd.randint(0, min(len(text) - idx, maxlen))
+                    edits.append((idx, n, rnd.choice(["", "ba", random_string(rnd, maxlen)])))
+                    end = idx + n + 1
+                te.apply_edits(rnd.sample(edits, len(edits)))
+                for idx, n, st in reversed(edits):
+                    text = text[:idx] + st + text[idx+n:]
+                if not edits:
+                    continue
+            elif r < 0.75:
+                count = te.replace_all("ab", "b")
+                text = text.replace("ab", "b")
+                if not count:
+                    continue
+            elif r < 0.9:
+                assert te.undo() == bool(undo)
+                if undo:
+                    redo.append(text)
+                    text = undo.pop()
+                check_rope(te.rope, text)
+                continue
+            else:
+                assert te.redo() == bool(redo)
+                if redo:
+                    undo.append(text)
+                    text = redo.pop()
+                check_rope(te.rope, text)
+                continue
+            undo.append(before)
+            redo = []
+            check_rope(te.rope, text)
+            if step % 20 == 0:
+                check_document(te, text, rnd)
+        check_document(te, text, rnd)
+
+def test_concat_split_and_from_leaflist_keep_the_rope_balanced():
+    rnd = random.Random(2)
+    for count in range(1, 70):
+        leaves = [rope_editor.RopeLeaf(str(i % 10)) for i in range(count)]
+        root = Rope.from_leaflist(leaves, 0, count)
+        assert check_node(root, 1) == "".join(str(i % 10) for i in range(count))
+    for _ in range(200):
+        a = "".join(rnd.choice("ab\n") for _ in range(rnd.randint(0, 300)))
+        b = "".join(rnd.choice("ab\n") for _ in range(rnd.choice([0, 1, 5, 2000])))
+        rope = Rope.from_string(a, maxlen=8)
+        rope.concat(Rope.from_string(b, maxlen=8))
+        check_rope(rope, a + b)
+        idx = rnd.randint(0, len(a + b))
+        right = rope.split(idx)
+        check_rope(rope, (a + b)[:idx])
+        check_rope(right, (a + b)[idx:])
+
+def test_typing_is_undone_in_one_step_up_to_maxlen():
+    te = TextEditor(Rope(8))
+    for i, char in enumerate("hello"):
+        te.insert_string(i, char)
+    for i in range(4, 1, -1):
+        # Backspace
+        te.delete_chars(i, 1)
+    assert te.get_string() == "he"
+    assert te.undo() and te.get_string() == "hello"
+    assert te.undo() and te.get_string() == ""
+    assert te.undo() == False
+    for i, char in enumerate("abcdefghij"):
+        te.insert_string(i, char)
+    # A merged operation holds at most maxlen chars
+    assert te.undo() and te.get_string() == "abcdefgh"
+    assert te.undo() and te.get_string() == ""
+    assert te.redo() and te.redo() and te.get_string() == "abcdefghij"
+
+def test_history_caps_drop_the_oldest_operations():
+    te = TextEditor(max_undo_ops=5, coalesce=False)
+    for i in range(10):
+        te.insert_string(0, str(i))
+    assert te.get_string() == "9876543210"
+    for _ in range(5):
+        assert te.undo()
+    assert te.undo() == False and te.get_string() == "43210"
+    te = TextEditor(Rope.from_string("x" * 10000, maxlen=16), max_undo_size=3000)
+    for _ in range(5):
+        te.delete_chars(0, 1000)
+        # The newest operation is always kept
+        assert te.undo_stack.total <= 3000 or te.undo_stack.count == 1
+        # Large deleted text is kept as nodes shared with the document
+        assert isinstance(te.undo_stack.peek().params[1], Rope)
+    assert te.undo_stack.count == 3
+    for _ in range(3):
+        assert te.undo()
+    assert te.undo() == False and te.length() == 8000